@@ -0,0 +1,321 @@
+# aria2_pool.py
+"""
+Self-managed aria2 daemons.
+
+The bot owns one or more aria2c processes, each with its own RPC port,
+secret and download dir. A background thread health-checks them, restarts
+any that crash or stop answering, and re-adds the downloads that were
+running on it (same GID, so callers' Download objects keep working and
+aria2 resumes from the partial file). New jobs go to the healthy instance
+with the fewest active downloads.
+
+Set ARIA2_MANAGED=false to use an aria2 started elsewhere (start.sh /
+docker-compose); it is still health-checked but never restarted.
+"""
+import logging
+import os
+import secrets
+import shutil
+import subprocess
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Options aria2 only accepts on the command line, not via changeGlobalOption
+STARTUP_ONLY_OPTIONS = {"disk-cache"}
+
+RPC_TIMEOUT = 10
+# Consecutive failed pings before an instance is restarted
+MAX_PING_FAILURES = 2
+
+
+class Aria2Instance:
+    def __init__(self, index: int, port: int, secret: str, download_dir: str, managed: bool):
+        self.index = index
+        self.port = port
+        self.secret = secret
+        self.download_dir = download_dir
+        self.managed = managed
+        self.proc: subprocess.Popen | None = None
+        self.healthy = False
+        self.ping_failures = 0
+        self.restarts = 0
+        # aria2p (and requests/websocket under it) only loads once a pool is built
+        from aria2p import API as Aria2API, Client as Aria2Client
+        self.api = Aria2API(
+            Aria2Client(
+                host="http://localhost",
+                port=port,
+                secret=secret,
+                timeout=RPC_TIMEOUT,
+            )
+        )
+
+    def __repr__(self):
+        return f"aria2#{self.index}(port={self.port})"
+
+    def spawn(self, global_options: dict):
+        if not self.managed:
+            return
+        if not shutil.which("aria2c"):
+            logger.error("[ARIA2] aria2c not found in PATH")
+            return
+        os.makedirs(self.download_dir, exist_ok=True)
+        cmd = [
+            "aria2c",
+            "--enable-rpc",
+            "--rpc-listen-all=false",
+            f"--rpc-listen-port={self.port}",
+            f"--rpc-secret={self.secret}",
+            f"--dir={self.download_dir}",
+            f"--stop-with-process={os.getpid()}",
+        ]
+        cmd += [f"--{k}={v}" for k, v in global_options.items()]
+        self.proc = subprocess.Popen(
+            cmd,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        logger.info(f"[ARIA2] Started {self} pid={self.proc.pid} dir={self.download_dir}")
+
+    def kill(self):
+        if self.proc is None:
+            return
+        try:
+            self.proc.kill()
+            self.proc.wait(timeout=5)
+        except Exception as e:
+            logger.error(f"[ARIA2] Failed to kill {self}: {e}")
+        self.proc = None
+
+    def process_alive(self) -> bool:
+        if not self.managed:
+            return True
+        return self.proc is not None and self.proc.poll() is None
+
+    def ping(self) -> bool:
+        try:
+            self.api.client.get_version()
+            return True
+        except Exception:
+            return False
+
+    def wait_ready(self, timeout: float) -> bool:
+        """Poll the RPC port with exponential backoff until it answers."""
+        deadline = time.monotonic() + timeout
+        delay = 0.05
+        while time.monotonic() < deadline:
+            if self.ping():
+                return True
+            if not self.process_alive():
+                return False
+            time.sleep(delay)
+            delay = min(delay * 2, 1.0)
+        return False
+
+
+class Aria2Pool:
+    def __init__(
+        self,
+        size: int,
+        base_port: int,
+        download_dirs: list[str],
+        global_options: dict,
+        check_interval: float,
+        ready_timeout: float = 30,
+        managed: bool = True,
+        secret: str = "",
+    ):
+        self.global_options = global_options
+        self.check_interval = check_interval
+        self.ready_timeout = ready_timeout
+        self.managed = managed
+        self.instances: list[Aria2Instance] = []
+        for i in range(size):
+            self.instances.append(
+                Aria2Instance(
+                    index=i,
+                    port=base_port + i,
+                    secret=secret if (secret or not managed) else secrets.token_hex(16),
+                    download_dir=os.path.abspath(download_dirs[i % len(download_dirs)]),
+                    managed=managed,
+                )
+            )
+        # Running downloads, for re-adding after an aria2 restart. In memory
+        # only: after a bot restart no job is left waiting on them.
+        # gid -> {"instance": idx, "uris": [...], "options": {...}}
+        self._journal: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        # Set while at least one instance answers RPC
+        self.ready = threading.Event()
+
+    @classmethod
+    def from_settings(cls, settings, global_options: dict) -> "Aria2Pool":
+        return cls(
+            size=settings.aria2_pool_size if settings.aria2_managed else 1,
+            base_port=settings.aria2_base_port,
+            download_dirs=list(settings.aria2_download_dirs),
+            global_options=global_options,
+            check_interval=settings.aria2_health_interval,
+            ready_timeout=settings.aria2_ready_timeout,
+            managed=settings.aria2_managed,
+            secret=settings.aria2_secret,
+        )
+
+    # ---------- lifecycle ----------
+
+    def _configure(self, inst: Aria2Instance):
+        if inst.managed:
+            return
+        # External daemon: push what can be changed at runtime
+        runtime_opts = {k: v for k, v in self.global_options.items() if k not in STARTUP_ONLY_OPTIONS}
+        try:
+            inst.api.set_global_options(runtime_opts)
+        except Exception as e:
+            logger.error(f"[ARIA2] Failed to set global options on {inst}: {e}")
+
+    def start(self):
+        """
+        Spawn the daemons and return right away. Readiness is awaited (with
+        backoff) in the supervisor thread, so the bot can connect to Telegram
+        in the meantime; use wait_ready() before adding downloads.
+        """
+        for inst in self.instances:
+            inst.spawn(self.global_options)
+        threading.Thread(target=self._supervise, name="aria2-supervisor", daemon=True).start()
+
+    def wait_ready(self, timeout: float | None = None) -> bool:
+        return self.ready.wait(timeout)
+
+    def _supervise(self):
+        started = time.monotonic()
+        for inst in self.instances:
+            inst.healthy = inst.wait_ready(self.ready_timeout)
+            if inst.healthy:
+                self._configure(inst)
+                self.ready.set()
+                logger.info(f"[ARIA2] {inst} is ready after {time.monotonic() - started:.2f}s")
+            else:
+                logger.error(f"[ARIA2] {inst} did not come up within {self.ready_timeout}s")
+        self._health_loop()
+
+    def stop(self):
+        self._stop.set()
+        for inst in self.instances:
+            inst.kill()
+
+    def _update_ready(self):
+        if any(inst.healthy for inst in self.instances):
+            self.ready.set()
+        else:
+            self.ready.clear()
+
+    def _restart(self, inst: Aria2Instance):
+        inst.healthy = False
+        self._update_ready()
+        if not inst.managed:
+            return
+        logger.warning(f"[ARIA2] Restarting {inst}")
+        inst.kill()
+        inst.spawn(self.global_options)
+        inst.restarts += 1
+        if not inst.wait_ready(self.ready_timeout):
+            logger.error(f"[ARIA2] {inst} failed to come back after restart")
+            return
+        inst.ping_failures = 0
+        inst.healthy = True
+        self.ready.set()
+        self._readd(inst)
+
+    def _readd(self, inst: Aria2Instance):
+        with self._lock:
+            entries = [(gid, e) for gid, e in self._journal.items() if e["instance"] == inst.index]
+        for gid, entry in entries:
+            try:
+                inst.api.add_uris(entry["uris"], options={**entry["options"], "gid": gid})
+                logger.info(f"[ARIA2] Re-added {gid} on {inst}")
+            except Exception as e:
+                logger.error(f"[ARIA2] Failed to re-add {gid} on {inst}: {e}")
+
+    def _health_loop(self):
+        while not self._stop.wait(self.check_interval):
+            for inst in self.instances:
+                if not inst.process_alive():
+                    logger.error(f"[ARIA2] {inst} process exited")
+                    self._restart(inst)
+                    continue
+                if inst.ping():
+                    if not inst.healthy:
+                        logger.info(f"[ARIA2] {inst} is healthy again")
+                        self._configure(inst)
+                    inst.ping_failures = 0
+                    inst.healthy = True
+                    self.ready.set()
+                    continue
+                inst.ping_failures += 1
+                # No new jobs for it; wait_ready()/add_uris block if it was the last one
+                inst.healthy = False
+                self._update_ready()
+                logger.warning(f"[ARIA2] {inst} ping failed ({inst.ping_failures}/{MAX_PING_FAILURES})")
+                if inst.ping_failures >= MAX_PING_FAILURES:
+                    self._restart(inst)
+
+    # ---------- jobs ----------
+
+    def _active_count(self, inst: Aria2Instance) -> int:
+        return sum(1 for e in self._journal.values() if e["instance"] == inst.index)
+
+    def add_uris(self, uris: list[str], options: dict | None = None):
+        """
+        Start a download on the least-loaded healthy instance. Blocking:
+        while every instance is down or restarting, waits up to
+        ready_timeout for one to come back.
+        """
+        options = options or {}
+        deadline = time.monotonic() + self.ready_timeout
+        while True:
+            with self._lock:
+                healthy = [i for i in self.instances if i.healthy]
+                if healthy:
+                    inst = min(healthy, key=self._active_count)
+                    break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self.ready.wait(remaining):
+                raise RuntimeError("no healthy aria2 instance")
+        download = inst.api.add_uris(uris, options=options)
+        with self._lock:
+            self._journal[download.gid] = {
+                "instance": inst.index,
+                "uris": list(uris),
+                "options": dict(options),
+            }
+        return download
+
+    def forget(self, gid: str):
+        """Stop tracking a download (finished, failed or cancelled)."""
+        with self._lock:
+            self._journal.pop(gid, None)
+
+    def remove(self, download):
+        """Force-remove a running download and its partial files (job cancelled)."""
+        self.forget(download.gid)
+        try:
+            download.api.remove([download], force=True, files=True, clean=True)
+        except Exception as e:
+            logger.error(f"[ARIA2] Failed to remove {download.gid}: {e}")
+
+    def status(self) -> list[dict]:
+        with self._lock:
+            return [
+                {
+                    "instance": inst.index,
+                    "port": inst.port,
+                    "pid": inst.proc.pid if inst.proc else None,
+                    "healthy": inst.healthy,
+                    "restarts": inst.restarts,
+                    "active": self._active_count(inst),
+                }
+                for inst in self.instances
+            ]
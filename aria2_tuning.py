@@ -0,0 +1,130 @@
+# aria2_tuning.py
+"""
+Per-download aria2 tuning.
+
+Instead of one global `split=10 / min-split-size=4M` for everything, pick the
+connection count, split size, file allocation and retry policy for each job
+from the size the resolver reported and what we have already seen from the
+same CDN host. Outcomes go to the shared per-host stats store (hoststats),
+so the choice keeps improving across restarts.
+"""
+import json
+import logging
+
+from hoststats import host_key, stats
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+GB = 1024 * MB
+
+# aria2 refuses more than 16 connections per server
+MAX_CONNECTIONS = 16
+
+# First profile whose max_size fits the job wins (None = no upper bound).
+DEFAULT_PROFILES = [
+    {"name": "small",  "max_size": 16 * MB,  "split": 1,  "min-split-size": "1M",  "file-allocation": "none"},
+    {"name": "medium", "max_size": 256 * MB, "split": 4,  "min-split-size": "8M",  "file-allocation": "none"},
+    {"name": "large",  "max_size": 2 * GB,   "split": 8,  "min-split-size": "16M", "file-allocation": "falloc"},
+    {"name": "huge",   "max_size": None,     "split": 16, "min-split-size": "32M", "file-allocation": "falloc"},
+]
+
+# Used when the resolver didn't tell us a size: the old global opts, which
+# left max-connection-per-server at aria2's default of 1
+UNKNOWN_PROFILE = {
+    "name": "unknown", "max_size": None, "split": 10, "max-connection-per-server": 1,
+    "min-split-size": "4M", "file-allocation": "prealloc",
+}
+
+
+def _check_profile(profile) -> None:
+    if not isinstance(profile, dict):
+        raise ValueError("every profile must be an object")
+    name = profile.get("name", "?")
+    for field in ("split", "max-connection-per-server"):
+        value = profile.get(field, 1)
+        if isinstance(value, bool) or not isinstance(value, (int, str)) or not str(value).isdigit() or int(value) < 1:
+            raise ValueError(f"profile {name}: {field} must be a positive integer, got {value!r}")
+    max_size = profile.get("max_size")
+    if max_size is not None and (isinstance(max_size, bool) or not isinstance(max_size, int) or max_size < 0):
+        raise ValueError(f"profile {name}: max_size must be a byte count or null, got {max_size!r}")
+
+
+def _load_profiles() -> list[dict]:
+    raw = get_settings().aria2_profiles
+    if not raw:
+        return DEFAULT_PROFILES
+    try:
+        profiles = json.loads(raw)
+        if not isinstance(profiles, list) or not profiles:
+            raise ValueError("must be a non-empty JSON list of objects")
+        for profile in profiles:
+            _check_profile(profile)
+        return profiles
+    except Exception as e:
+        logger.error(f"[TUNING] Ignoring invalid ARIA2_PROFILES: {e}")
+        return DEFAULT_PROFILES
+
+
+PROFILES = _load_profiles()
+
+
+def _pick_profile(size: int) -> dict:
+    if size <= 0:
+        return UNKNOWN_PROFILE
+    for profile in PROFILES:
+        max_size = profile.get("max_size")
+        if max_size is None or size <= max_size:
+            return profile
+    return PROFILES[-1]
+
+
+def pick_options(size: int, host: str) -> tuple[str, dict]:
+    """
+    Choose aria2 per-download options for a job.
+    Returns (profile_name, options) where options can be passed straight
+    to `aria2.add_uris(..., options=options)`.
+    """
+    profile = _pick_profile(size)
+    split = int(profile.get("split", 10))
+    max_tries = 50
+    retry_wait = 3
+
+    summary = stats.summary(host_key(host))
+    if summary:
+        failure_rate = summary["failure_rate"]
+        per_conn = summary["bps_per_conn"]
+
+        if failure_rate > 0.3:
+            # Flaky host: many parallel connections tend to get us throttled
+            split = max(1, split // 2)
+            retry_wait = 10
+        elif per_conn and size > 64 * MB and per_conn < 512 * 1024:
+            # Each connection is slow but the host keeps up: open more of them
+            split = min(MAX_CONNECTIONS, split * 2)
+
+    split = max(1, min(MAX_CONNECTIONS, split))
+    per_server = max(1, min(split, int(profile.get("max-connection-per-server", split))))
+    options = {
+        "split": str(split),
+        "max-connection-per-server": str(per_server),
+        "min-split-size": str(profile.get("min-split-size", "4M")),
+        "file-allocation": str(profile.get("file-allocation", "prealloc")),
+        "max-tries": str(max_tries),
+        "retry-wait": str(retry_wait),
+    }
+    logger.info(f"[TUNING] host={host} size={size} -> profile={profile.get('name')} opts={options}")
+    return profile.get("name", "custom"), options
+
+
+def record_outcome(
+    host: str,
+    size: int,
+    seconds: float,
+    connections: int,
+    ok: bool,
+    ttfb: float | None = None,
+):
+    """Record how a download went so future picks for this host improve."""
+    stats.record(host_key(host), ok, size=size, seconds=seconds, ttfb=ttfb, connections=connections)
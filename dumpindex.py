@@ -0,0 +1,244 @@
+# dumpindex.py
+"""
+In-memory index of everything already uploaded to the dump chat.
+
+Entries are keyed by the Terabox share link (normalized to its `surl`) and
+hold the dump message id of every part plus title and size, so a link we
+have seen before can be answered with copy_message instead of a new
+download. Inline queries search titles, and `/start <token>` deep links
+point at one entry.
+
+The index is fed from our own uploads, from dump-chat posts the bot sees,
+and (when a user session is available) a history backfill at startup.
+It is saved to DUMP_INDEX_FILE so restarts only need to backfill the gap.
+
+Dump captions carry the source link on a "🔗" line; that is what makes the
+chat itself the source of truth.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+TITLE_PREFIX = "✨ "
+LINK_PREFIX = "🔗 "
+PART_RE = re.compile(r"Part (\d+)/(\d+)")
+URL_RE = re.compile(r"https?://\S+")
+
+# Media attributes we can index, in the order Pyrogram fills them
+MEDIA_KINDS = ("video", "document", "photo", "audio", "animation")
+
+SAVE_INTERVAL = 30
+
+
+def normalize_link(url: str) -> str:
+    """
+    Reduce the many forms of a share link to one key:
+    /s/1AbC, /sharing/link?surl=AbC, any mirror domain -> "AbC".
+    """
+    parsed = urlparse(url.strip())
+    surl = parse_qs(parsed.query).get("surl", [""])[0]
+    if not surl and "/s/" in parsed.path:
+        surl = parsed.path.split("/s/", 1)[1].split("/")[0]
+        if surl.startswith("1"):
+            surl = surl[1:]
+    return surl or (parsed.netloc + parsed.path).lower()
+
+
+def link_token(key: str) -> str:
+    """Short, deep-link safe id for an index key."""
+    return hashlib.blake2b(key.encode(), digest_size=8).hexdigest()
+
+
+def parse_caption(caption: str) -> tuple[str | None, str | None, int, int]:
+    """Return (title, link, part, parts) from one of our dump captions."""
+    title = link = None
+    part, parts = 1, 1
+    for line in (caption or "").splitlines():
+        if line.startswith(TITLE_PREFIX) and title is None:
+            title = line[len(TITLE_PREFIX):].strip()
+        elif line.startswith(LINK_PREFIX) and link is None:
+            m = URL_RE.search(line)
+            if m:
+                link = m.group(0)
+        else:
+            m = PART_RE.search(line)
+            if m:
+                part, parts = int(m.group(1)), int(m.group(2))
+    return title, link, part, parts
+
+
+def _media_of(message):
+    for kind in MEDIA_KINDS:
+        media = getattr(message, kind, None)
+        if media is not None:
+            return kind, media
+    return None, None
+
+
+class DumpIndex:
+    def __init__(self, path: str):
+        self.path = path
+        # token -> {"key", "link", "title", "size", "parts", "messages": {part: {"id", "kind", "file_id"}}}
+        self._entries: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.max_message_id = 0
+
+    # ---------- persistence ----------
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            with self._lock:
+                for token, entry in data.get("entries", {}).items():
+                    entry["messages"] = {int(p): m for p, m in entry["messages"].items()}
+                    self._entries[token] = entry
+                self.max_message_id = data.get("max_message_id", 0)
+            logger.info(f"[INDEX] Loaded {len(self._entries)} entries from {self.path}")
+        except Exception as e:
+            logger.error(f"[INDEX] Failed to load {self.path}: {e}")
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {"max_message_id": self.max_message_id, "entries": self._entries}
+            payload = json.dumps(data, separators=(",", ":"))
+            self._dirty = False
+        try:
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                f.write(payload)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            logger.error(f"[INDEX] Failed to write {self.path}: {e}")
+
+    def start(self):
+        """Load the saved index and start the periodic save thread."""
+        self.load()
+        threading.Thread(target=self._save_loop, name="dumpindex-save", daemon=True).start()
+
+    def _save_loop(self):
+        while True:
+            time.sleep(SAVE_INTERVAL)
+            self.save()
+
+    # ---------- updates ----------
+
+    def add_message(self, message, bot_view: bool = True) -> bool:
+        """
+        Index one dump-chat message. `bot_view` says whether the message was
+        fetched by the bot (its file_id is then usable for inline results).
+        Returns False if it isn't one of our uploads.
+        """
+        title, link, part, parts = parse_caption(message.caption or "")
+        kind, media = _media_of(message)
+        if not link or media is None:
+            return False
+
+        key = normalize_link(link)
+        token = link_token(key)
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or entry["parts"] != parts:
+                entry = self._entries[token] = {
+                    "key": key,
+                    "link": link,
+                    "title": title or getattr(media, "file_name", None) or "file",
+                    "size": 0,
+                    "parts": parts,
+                    "messages": {},
+                }
+            previous = entry["messages"].get(part) or {}
+            entry["messages"][part] = {
+                "id": message.id,
+                "kind": kind,
+                "size": getattr(media, "file_size", 0) or 0,
+                "file_id": media.file_id if bot_view else previous.get("file_id"),
+            }
+            entry["size"] = sum(m["size"] for m in entry["messages"].values())
+            self.max_message_id = max(self.max_message_id, message.id)
+            self._dirty = True
+        return True
+
+    def remove(self, token: str):
+        with self._lock:
+            if self._entries.pop(token, None) is not None:
+                self._dirty = True
+
+    async def backfill(self, client, chat_id: int, limit: int):
+        """Index dump-chat history newer than what we already have (needs a user session)."""
+        added = 0
+        stop_at = self.max_message_id
+        try:
+            async for message in client.get_chat_history(chat_id, limit=limit):
+                if message.id <= stop_at:
+                    break
+                if self.add_message(message, bot_view=False):
+                    added += 1
+        except Exception as e:
+            logger.error(f"[INDEX] Backfill failed: {e}")
+        logger.info(f"[INDEX] Backfill added {added} messages, {len(self._entries)} entries total")
+
+    async def resolve_file_ids(self, client, chat_id: int, entries: list[dict]):
+        """Fill in bot-usable file_ids for entries that only have message ids."""
+        missing = [m["id"] for e in entries for m in e["messages"].values() if not m.get("file_id")]
+        for i in range(0, len(missing), 200):
+            try:
+                messages = await client.get_messages(chat_id, missing[i:i + 200])
+            except Exception as e:
+                logger.error(f"[INDEX] Failed to fetch dump messages: {e}")
+                return
+            for message in messages:
+                if message and not message.empty:
+                    self.add_message(message, bot_view=True)
+
+    # ---------- queries ----------
+
+    def _complete(self, entry: dict) -> bool:
+        return len(entry["messages"]) == entry["parts"]
+
+    def lookup_link(self, url: str) -> dict | None:
+        return self.get(link_token(normalize_link(url)))
+
+    def get(self, token: str) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or not self._complete(entry):
+                return None
+            return {**entry, "token": token}
+
+    def search(self, query: str, limit: int = 20) -> list[dict]:
+        """Entries whose title contains every word of `query`, newest first; a link matches exactly."""
+        query = query.strip()
+        if URL_RE.match(query):
+            entry = self.lookup_link(query)
+            return [entry] if entry else []
+
+        words = query.lower().split()
+        with self._lock:
+            hits = [
+                {**e, "token": t}
+                for t, e in self._entries.items()
+                if self._complete(e) and all(w in e["title"].lower() for w in words)
+            ]
+        hits.sort(key=lambda e: max(m["id"] for m in e["messages"].values()), reverse=True)
+        return hits[:limit]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+index = DumpIndex(get_settings().dump_index_file)
@@ -0,0 +1,215 @@
+# hoststats.py
+"""
+Per-host throughput / latency / failure statistics.
+
+Every download (aria2 or in-memory) and every resolver call records an
+outcome under a key such as "host:d.terabox.com" or "backend:teradl.tiiny.io".
+Outcomes are summed into fixed time buckets (BUCKET_SECONDS wide) kept in a
+ring buffer per key, so memory stays bounded and old behaviour ages out.
+A background thread writes everything to a small JSON file every
+HOST_STATS_FLUSH_INTERVAL seconds; it is loaded again at startup.
+
+Other modules query it through summary(), rank() and suggest_timeout() to
+pick backends, connection counts and timeouts.
+"""
+import collections
+import json
+import logging
+import os
+import threading
+import time
+
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+BUCKET_SECONDS = 300
+BUCKETS = 288  # 24 h of 5 min buckets
+# How far back summary() looks by default
+DEFAULT_WINDOW = 6 * 3600
+# Below this many attempts in the window a key counts as unknown
+MIN_ATTEMPTS = 3
+
+# Fields summed in each bucket (each bucket also keeps its slowest ttfb)
+FIELDS = ("n", "fail", "bytes", "secs", "conns", "ttfb_sum", "ttfb_n")
+
+
+def _new_bucket(start: int) -> dict:
+    bucket = {f: 0 for f in FIELDS}
+    bucket["t"] = start
+    bucket["ttfb_max"] = 0
+    return bucket
+
+
+class HostStats:
+    def __init__(self, path: str, flush_interval: float):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._rings: dict[str, collections.deque] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._thread = None
+
+    # ---------- persistence ----------
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            oldest = time.time() - BUCKETS * BUCKET_SECONDS
+            with self._lock:
+                for key, buckets in data.items():
+                    ring = collections.deque(maxlen=BUCKETS)
+                    ring.extend(b for b in buckets if b.get("t", 0) >= oldest)
+                    if ring:
+                        self._rings[key] = ring
+            logger.info(f"[STATS] Loaded stats for {len(self._rings)} keys from {self.path}")
+        except Exception as e:
+            logger.error(f"[STATS] Failed to load {self.path}: {e}")
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {key: list(ring) for key, ring in self._rings.items()}
+            self._dirty = False
+        try:
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(data, f, separators=(",", ":"))
+            os.replace(tmp, self.path)
+        except Exception as e:
+            logger.error(f"[STATS] Failed to write {self.path}: {e}")
+
+    def start(self):
+        """Load saved stats and start the periodic flush thread."""
+        if self._thread is not None:
+            return
+        self.load()
+        self._thread = threading.Thread(target=self._flush_loop, name="hoststats-flush", daemon=True)
+        self._thread.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    # ---------- recording ----------
+
+    def record(
+        self,
+        key: str,
+        ok: bool,
+        size: int = 0,
+        seconds: float = 0.0,
+        ttfb: float | None = None,
+        connections: int = 1,
+    ):
+        """
+        Record one attempt. size/seconds/connections/ttfb only count for
+        successes: a fast failure (instant 404) says nothing about how long
+        a working request takes.
+        """
+        now = int(time.time())
+        start = now - now % BUCKET_SECONDS
+        with self._lock:
+            ring = self._rings.get(key)
+            if ring is None:
+                ring = self._rings[key] = collections.deque(maxlen=BUCKETS)
+            if not ring or ring[-1]["t"] != start:
+                ring.append(_new_bucket(start))
+            bucket = ring[-1]
+            bucket["n"] += 1
+            if not ok:
+                bucket["fail"] += 1
+            else:
+                if size > 0 and seconds > 0:
+                    bucket["bytes"] += size
+                    bucket["secs"] += seconds
+                    bucket["conns"] += connections
+                if ttfb is not None:
+                    bucket["ttfb_sum"] += ttfb
+                    bucket["ttfb_n"] += 1
+                    bucket["ttfb_max"] = max(bucket.get("ttfb_max", 0), ttfb)
+            self._dirty = True
+
+    # ---------- queries ----------
+
+    def summary(self, key: str, window: float = DEFAULT_WINDOW) -> dict | None:
+        """
+        Aggregate of the last `window` seconds for a key, or None if there
+        are fewer than MIN_ATTEMPTS attempts in it.
+        """
+        since = time.time() - window
+        totals = {f: 0 for f in FIELDS}
+        ttfb_max = 0.0
+        with self._lock:
+            for bucket in self._rings.get(key, ()):
+                if bucket["t"] + BUCKET_SECONDS < since:
+                    continue
+                for f in FIELDS:
+                    totals[f] += bucket[f]
+                ttfb_max = max(ttfb_max, bucket.get("ttfb_max", 0))
+        if totals["n"] < MIN_ATTEMPTS:
+            return None
+
+        ok_n = totals["n"] - totals["fail"]
+        bps = totals["bytes"] / totals["secs"] if totals["secs"] else 0.0
+        avg_conns = totals["conns"] / ok_n if ok_n else 0
+        return {
+            "attempts": totals["n"],
+            "failures": totals["fail"],
+            "failure_rate": totals["fail"] / totals["n"],
+            "bps": bps,
+            "bps_per_conn": bps / avg_conns if avg_conns else 0.0,
+            "ttfb": totals["ttfb_sum"] / totals["ttfb_n"] if totals["ttfb_n"] else None,
+            "ttfb_max": ttfb_max or None,
+        }
+
+    def score(self, key: str) -> float | None:
+        s = self.summary(key)
+        if s is None:
+            return None
+        # Throughput when we have it, else inverse latency; both damped by failures
+        base = s["bps"] or (1.0 / s["ttfb"] if s["ttfb"] else 1.0)
+        return base * (1 - s["failure_rate"]) ** 2
+
+    def rank(self, keys: list[str]) -> list[str]:
+        """
+        Order keys best first. Keys we know nothing about go first, in their
+        given order, so new hosts/backends get tried and measured.
+        """
+        unknown = [k for k in keys if self.score(k) is None]
+        known = sorted((k for k in keys if k not in unknown), key=self.score, reverse=True)
+        return unknown + known
+
+    def suggest_timeout(self, key: str, default: float, low: float = 15, high: float = 120) -> float:
+        """
+        A timeout well above the slowest successful time to first byte seen
+        in the window (2x the max, at least 4x the mean), within [low, high].
+        A handful of fast samples can't push it below `low`.
+        """
+        s = self.summary(key)
+        if s is None or s["ttfb"] is None:
+            return default
+        return max(low, min(high, max(2 * (s["ttfb_max"] or 0), 4 * s["ttfb"])))
+
+    def keys(self) -> list[str]:
+        with self._lock:
+            return list(self._rings)
+
+
+stats = HostStats(
+    path=get_settings().host_stats_file,
+    flush_interval=get_settings().host_stats_flush_interval,
+)
+
+
+def host_key(host: str) -> str:
+    return f"host:{host}"
+
+
+def backend_key(backend: str) -> str:
+    return f"backend:{backend}"
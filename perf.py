@@ -0,0 +1,176 @@
+# perf.py
+"""
+Event-loop lag monitor and sampling profiler.
+
+A heartbeat task on the loop measures how late each `asyncio.sleep` wakes up
+(= loop lag). A watchdog thread notices when the heartbeat stops for longer
+than the slow-callback threshold and logs the loop thread's current stack,
+which points straight at whatever is blocking (a sync HTTP call, disk I/O,
+an inline RPC, ...).
+
+`sample()` takes an on-demand statistical profile of the loop thread and
+returns the most common stacks. It runs in its own thread, so it can be
+called from Flask directly or from the bot via `asyncio.to_thread`.
+"""
+import asyncio
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+PERF_LAG_INTERVAL = get_settings().perf_lag_interval
+PERF_SLOW_CALLBACK_MS = get_settings().perf_slow_callback_ms
+
+# Frames that mean "loop is idle, waiting for I/O"
+IDLE_FUNCS = {"select", "poll", "epoll", "kqueue", "_run_once"}
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    idx = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[idx]
+
+
+def _collapse(frame, limit: int = 12) -> str:
+    """Turn a frame into 'file:func;file:func;...' (outermost first)."""
+    parts = []
+    while frame is not None and len(parts) < limit:
+        code = frame.f_code
+        parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+class LoopMonitor:
+    def __init__(self, interval: float = PERF_LAG_INTERVAL, threshold_ms: float = PERF_SLOW_CALLBACK_MS):
+        self.interval = interval
+        self.threshold = threshold_ms / 1000
+        self.lags = collections.deque(maxlen=int(600 / interval))  # ~10 min window
+        self.slow_events = collections.deque(maxlen=20)
+        self.max_lag = 0.0
+        self.loop_thread_id = None
+        self.last_beat = time.monotonic()
+        self.started_at = None
+        self._stall_reported = False
+        self._task = None
+
+    def start(self):
+        """Must be called from inside the running event loop."""
+        if self._task is not None:
+            return
+        self.loop_thread_id = threading.get_ident()
+        self.started_at = time.time()
+        self.last_beat = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        threading.Thread(target=self._watchdog, name="perf-watchdog", daemon=True).start()
+        logger.info(
+            f"[PERF] Loop monitor started (interval={self.interval}s, "
+            f"slow callback threshold={self.threshold * 1000:.0f}ms)"
+        )
+
+    async def _heartbeat(self):
+        while True:
+            before = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - before - self.interval)
+            self.lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if self._stall_reported and self.slow_events:
+                # The stall we logged is over; record how long it really was
+                self.slow_events[-1]["duration_ms"] = round(lag * 1000, 1)
+            self._stall_reported = False
+            self.last_beat = now
+
+    def _watchdog(self):
+        while True:
+            time.sleep(self.threshold / 2)
+            stalled = time.monotonic() - self.last_beat - self.interval
+            if stalled < self.threshold or self._stall_reported:
+                continue
+            frame = sys._current_frames().get(self.loop_thread_id)
+            if frame is None:
+                continue
+            stack = "".join(traceback.format_stack(frame))
+            self._stall_reported = True
+            self.slow_events.append({
+                "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "duration_ms": round(stalled * 1000, 1),
+                "stack": stack,
+            })
+            logger.warning(f"[PERF] Event loop blocked for {stalled * 1000:.0f}ms+, stack:\n{stack}")
+
+    def snapshot(self) -> dict:
+        lags = list(self.lags)
+        return {
+            "uptime_s": round(time.time() - self.started_at, 1) if self.started_at else 0,
+            "lag_ms": {
+                "last": round(lags[-1] * 1000, 1) if lags else 0.0,
+                "p50": round(_percentile(lags, 50) * 1000, 1),
+                "p99": round(_percentile(lags, 99) * 1000, 1),
+                "max": round(self.max_lag * 1000, 1),
+            },
+            "slow_callbacks": len(self.slow_events),
+            "recent_slow": list(self.slow_events)[-5:],
+        }
+
+    def sample(self, seconds: float, interval: float = 0.005, top: int = 15) -> dict:
+        """Sample the loop thread's stack for `seconds` and return the top stacks."""
+        counts = collections.Counter()
+        total = 0
+        idle = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(self.loop_thread_id)
+            if frame is not None:
+                total += 1
+                if frame.f_code.co_name in IDLE_FUNCS:
+                    idle += 1
+                else:
+                    counts[_collapse(frame)] += 1
+            time.sleep(interval)
+        return {
+            "seconds": seconds,
+            "samples": total,
+            "idle_pct": round(idle * 100 / total, 1) if total else 0.0,
+            "top": [
+                {"pct": round(n * 100 / total, 1), "stack": stack}
+                for stack, n in counts.most_common(top)
+            ],
+        }
+
+
+monitor = LoopMonitor()
+
+
+def format_snapshot(snap: dict) -> str:
+    lag = snap["lag_ms"]
+    lines = [
+        "📊 Event loop",
+        f"uptime: {snap['uptime_s']}s",
+        f"lag ms: last {lag['last']} | p50 {lag['p50']} | p99 {lag['p99']} | max {lag['max']}",
+        f"slow callbacks: {snap['slow_callbacks']}",
+    ]
+    for ev in snap["recent_slow"]:
+        last_frame = ev["stack"].strip().splitlines()[-2:] if ev["stack"] else []
+        lines.append(f"\n⏱ {ev['time']} blocked {ev['duration_ms']}ms at:\n" + "\n".join(last_frame))
+    return "\n".join(lines)
+
+
+def format_profile(prof: dict) -> str:
+    lines = [
+        f"🔬 Profile {prof['seconds']}s, {prof['samples']} samples, idle {prof['idle_pct']}%",
+    ]
+    for item in prof["top"]:
+        leaf = ";".join(item["stack"].split(";")[-3:])
+        lines.append(f"{item['pct']:>5}%  {leaf}")
+    return "\n".join(lines)
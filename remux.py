@@ -0,0 +1,170 @@
+# remux.py
+"""
+Remux non-streamable videos (.mkv / .avi / .webm) to faststart MP4 so
+Telegram clients can play them without downloading the whole file.
+
+Streams are copied when the codecs are MP4/Telegram friendly. Otherwise they
+are re-encoded only if REMUX_TRANSCODE is on, using REMUX_VIDEO_ENCODER
+(libx264 by default, or a hardware encoder such as h264_nvenc / h264_qsv /
+h264_vaapi when the host has one).
+
+Conversions run as ffmpeg subprocesses, at most REMUX_WORKERS at a time, so
+the event loop and other jobs' uploads keep going. Each job has a time
+budget (REMUX_TIMEOUT, including time spent waiting for a slot); when it
+runs out, or anything fails, the caller gets None and should upload the
+original file as a document.
+"""
+import asyncio
+import json
+import logging
+import os
+import shutil
+import time
+
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+_settings = get_settings()
+REMUX_TRANSCODE = _settings.remux_transcode
+REMUX_VIDEO_ENCODER = _settings.remux_video_encoder
+REMUX_WORKERS = _settings.remux_workers
+REMUX_TIMEOUT = _settings.remux_timeout
+
+# ffmpeg is shipped as "xtra" in our image (see split_video_with_ffmpeg)
+FFMPEG_BIN = _settings.ffmpeg_bin
+FFPROBE_BIN = _settings.ffprobe_bin
+
+# Without both binaries every remux would fail and fall back to a document,
+# which is worse than sending the original as a video like we used to
+_missing = [b for b in (FFMPEG_BIN, FFPROBE_BIN) if shutil.which(b) is None]
+REMUX_ENABLED = _settings.remux_enabled and not _missing
+if _settings.remux_enabled and _missing:
+    logger.warning(f"[REMUX] Disabled, not found on PATH: {', '.join(_missing)}")
+
+REMUX_EXTS = (".mkv", ".avi", ".webm")
+MP4_VIDEO_CODECS = ("h264", "hevc")
+MP4_AUDIO_CODECS = ("aac", "mp3")
+
+_slots = asyncio.Semaphore(REMUX_WORKERS)
+
+
+def needs_remux(ext: str) -> bool:
+    return REMUX_ENABLED and ext.lower() in REMUX_EXTS
+
+
+async def probe_codecs(path: str) -> tuple[str | None, list[str]]:
+    """Return (video_codec, [audio_codecs]) of a file using ffprobe."""
+    proc = await asyncio.create_subprocess_exec(
+        FFPROBE_BIN, "-v", "error",
+        "-show_entries", "stream=codec_type,codec_name",
+        "-of", "json", path,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, _ = await proc.communicate()
+    except asyncio.CancelledError:
+        # Timed out (wait_for) or job cancelled: don't leave ffprobe behind
+        if proc.returncode is None:
+            proc.kill()
+        raise
+    streams = json.loads(stdout.decode() or "{}").get("streams", [])
+
+    video = None
+    audio = []
+    for s in streams:
+        if s.get("codec_type") == "video" and video is None:
+            video = s.get("codec_name")
+        elif s.get("codec_type") == "audio":
+            audio.append(s.get("codec_name"))
+    return video, audio
+
+
+def build_command(input_path: str, output_path: str, video: str, audio: list[str]) -> list[str] | None:
+    """ffmpeg args for the conversion, or None if it would need a transcode we're not allowed to do."""
+    copy_video = video in MP4_VIDEO_CODECS
+    copy_audio = all(a in MP4_AUDIO_CODECS for a in audio)
+    if not (copy_video and copy_audio) and not REMUX_TRANSCODE:
+        return None
+
+    cmd = [FFMPEG_BIN, "-y", "-i", input_path, "-map", "0:v:0", "-map", "0:a?", "-sn"]
+    if copy_video:
+        cmd += ["-c:v", "copy"]
+        if video == "hevc":
+            # Apple/Telegram players want the hvc1 tag for HEVC in MP4
+            cmd += ["-tag:v", "hvc1"]
+    else:
+        cmd += ["-c:v", REMUX_VIDEO_ENCODER, "-pix_fmt", "yuv420p"]
+        if REMUX_VIDEO_ENCODER == "libx264":
+            cmd += ["-preset", "veryfast", "-crf", "23"]
+    cmd += ["-c:a", "copy"] if copy_audio else ["-c:a", "aac", "-b:a", "160k"]
+    cmd += ["-movflags", "+faststart", output_path]
+    return cmd
+
+
+async def remux_to_mp4(input_path: str, timeout: float = REMUX_TIMEOUT) -> str | None:
+    """
+    Convert input_path to a faststart MP4 next to it.
+    Returns the new path, or None if the caller should fall back to
+    uploading the original as a document.
+    """
+    output_path = os.path.splitext(input_path)[0] + ".mp4"
+    deadline = time.monotonic() + timeout
+    proc = None
+
+    try:
+        video, audio = await asyncio.wait_for(probe_codecs(input_path), timeout)
+        if not video:
+            logger.info(f"[REMUX] No video stream in {input_path}, skipping")
+            return None
+
+        cmd = build_command(input_path, output_path, video, audio)
+        if cmd is None:
+            logger.info(f"[REMUX] {video}/{audio} needs a transcode and REMUX_TRANSCODE is off")
+            return None
+
+        await asyncio.wait_for(_slots.acquire(), deadline - time.monotonic())
+        try:
+            started = time.monotonic()
+            proc = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL
+            )
+            await asyncio.wait_for(proc.wait(), deadline - time.monotonic())
+        finally:
+            _slots.release()
+
+        if proc.returncode != 0:
+            logger.error(f"[REMUX] ffmpeg exited with {proc.returncode} for {input_path}")
+            _remove(output_path)
+            return None
+
+        logger.info(f"[REMUX] {os.path.basename(input_path)} -> mp4 in {time.monotonic() - started:.1f}s")
+        return output_path
+
+    except asyncio.CancelledError:
+        # Job was cancelled: don't leave ffmpeg running or a half-written file
+        if proc is not None and proc.returncode is None:
+            proc.kill()
+        _remove(output_path)
+        raise
+    except asyncio.TimeoutError:
+        logger.warning(f"[REMUX] Time budget of {timeout:.0f}s exceeded for {input_path}")
+    except Exception as e:
+        logger.error(f"[REMUX] Failed for {input_path}: {e}")
+
+    if proc is not None and proc.returncode is None:
+        proc.kill()
+        await proc.wait()
+    _remove(output_path)
+    return None
+
+
+def _remove(path: str):
+    try:
+        if os.path.exists(path):
+            os.remove(path)
+    except Exception:
+        pass
@@ -0,0 +1,197 @@
+# settings.py
+"""
+Typed bot configuration, read from the environment once.
+
+Every env var the bot understands is parsed and validated here, so a bad
+value stops the bot at startup with a clear message instead of failing
+halfway through a job. Use `get_settings()`; the result is cached.
+"""
+import functools
+import logging
+import os
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+GB = 1024 * 1024 * 1024
+
+
+def _fail(msg: str):
+    logger.error(msg)
+    raise SystemExit(1)
+
+
+def _str(name: str, default: str = "", required: bool = False) -> str:
+    value = os.environ.get(name, default).strip()
+    if required and not value:
+        _fail(f"{name} variable is missing! Exiting now")
+    return value
+
+
+def _int(name: str, default: int | None = None, required: bool = False) -> int:
+    raw = _str(name, "" if default is None else str(default), required)
+    try:
+        return int(raw)
+    except ValueError:
+        _fail(f"{name} must be integer, got: {raw}")
+
+
+def _float(name: str, default: float) -> float:
+    raw = _str(name, str(default))
+    try:
+        return float(raw)
+    except ValueError:
+        _fail(f"{name} must be a number, got: {raw}")
+
+
+def _bool(name: str, default: bool) -> bool:
+    raw = _str(name, "true" if default else "false").lower()
+    if raw in ("1", "true", "yes", "on"):
+        return True
+    if raw in ("0", "false", "no", "off"):
+        return False
+    _fail(f"{name} must be true/false, got: {raw}")
+
+
+def _int_set(name: str) -> frozenset[int]:
+    ids = set()
+    for part in _str(name).replace(" ", "").split(","):
+        if not part:
+            continue
+        try:
+            ids.add(int(part))
+        except ValueError:
+            _fail(f"{name} must be comma separated integers, got: {part}")
+    return frozenset(ids)
+
+
+@dataclass(frozen=True)
+class Settings:
+    # Telegram
+    api_id: int
+    api_hash: str
+    bot_token: str
+    dump_chat_id: int
+    fsub_id: str
+    user_session_string: str | None
+    owner_ids: frozenset[int]
+
+    # Resolver backends, tried best first (see hoststats)
+    tera_api_urls: tuple[str, ...]
+
+    # Jobs processed at the same time (the rest queue)
+    max_concurrent_jobs: int
+
+    # Files up to this size skip aria2/disk and go straight to Telegram (0 = off)
+    stream_upload_max_size: int
+    # Total bytes all in-memory buffers together may hold
+    stream_memory_budget: int
+
+    # HTTP keep-alive / probes
+    web_server: bool
+    web_host: str
+    port: int
+    perf_token: str
+
+    # aria2
+    aria2_managed: bool
+    aria2_pool_size: int
+    aria2_base_port: int
+    aria2_download_dirs: tuple[str, ...]
+    aria2_health_interval: float
+    aria2_secret: str
+    aria2_disk_cache: str
+    aria2_ready_timeout: float
+    aria2_profiles: str
+
+    # Dump-chat index (inline mode / deep links)
+    dump_index_file: str
+    dump_index_backfill: int
+
+    # Per-host stats store
+    host_stats_file: str
+    host_stats_flush_interval: float
+
+    # Remux
+    remux_enabled: bool
+    remux_transcode: bool
+    remux_video_encoder: str
+    remux_workers: int
+    remux_timeout: float
+    ffmpeg_bin: str
+    ffprobe_bin: str
+
+    # Job tracing (JSON lines, see tracing.py; empty file = off)
+    trace_file: str
+    trace_max_bytes: int
+    trace_backups: int
+
+    # Profiling
+    perf_lag_interval: float
+    perf_slow_callback_ms: float
+
+    @property
+    def split_size(self) -> int:
+        # Premium user sessions can upload 4 GB, bots only 2 GB
+        return 4 * GB if self.user_session_string else 2 * GB
+
+
+def _load() -> Settings:
+    dirs = tuple(d.strip() for d in _str("ARIA2_DOWNLOAD_DIRS").split(",") if d.strip())
+    pool_size = max(1, _int("ARIA2_POOL_SIZE", 1))
+    if not dirs:
+        dirs = ("downloads",) if pool_size == 1 else tuple(os.path.join("downloads", str(i)) for i in range(pool_size))
+
+    user_session = _str("USER_SESSION_STRING")
+    if not user_session:
+        logger.info("USER_SESSION_STRING variable is missing! Bot will split files in 2 GB…")
+
+    return Settings(
+        api_id=_int("TELEGRAM_API", required=True),
+        api_hash=_str("TELEGRAM_HASH", required=True),
+        bot_token=_str("BOT_TOKEN", required=True),
+        dump_chat_id=_int("DUMP_CHAT_ID", required=True),
+        fsub_id=_str("FSUB_ID", required=True),
+        user_session_string=user_session or None,
+        owner_ids=_int_set("OWNER_ID"),
+        tera_api_urls=tuple(
+            u.strip() for u in _str("TERA_API_URL", "https://teradl.tiiny.io/").split(",") if u.strip()
+        ),
+        max_concurrent_jobs=max(1, _int("MAX_CONCURRENT_JOBS", 4)),
+        stream_upload_max_size=max(0, _int("STREAM_UPLOAD_MAX_SIZE", 20 * 1024 * 1024)),
+        stream_memory_budget=max(0, _int("STREAM_MEMORY_BUDGET", 128 * 1024 * 1024)),
+        web_server=_bool("WEB_SERVER", True),
+        web_host=_str("WEB_HOST", "0.0.0.0"),
+        port=_int("PORT", 5000),
+        perf_token=_str("PERF_TOKEN"),
+        aria2_managed=_bool("ARIA2_MANAGED", True),
+        aria2_pool_size=pool_size,
+        aria2_base_port=_int("ARIA2_BASE_PORT", 6800),
+        aria2_download_dirs=dirs,
+        aria2_health_interval=_float("ARIA2_HEALTH_INTERVAL", 10),
+        aria2_secret=_str("ARIA2_SECRET"),
+        aria2_disk_cache=_str("ARIA2_DISK_CACHE", "64M"),
+        aria2_ready_timeout=_float("ARIA2_READY_TIMEOUT", 30),
+        aria2_profiles=_str("ARIA2_PROFILES"),
+        dump_index_file=_str("DUMP_INDEX_FILE", "dump_index.json"),
+        dump_index_backfill=max(0, _int("DUMP_INDEX_BACKFILL", 5000)),
+        host_stats_file=_str("HOST_STATS_FILE", "host_stats.json"),
+        host_stats_flush_interval=_float("HOST_STATS_FLUSH_INTERVAL", 60),
+        remux_enabled=_bool("REMUX_ENABLED", True),
+        remux_transcode=_bool("REMUX_TRANSCODE", False),
+        remux_video_encoder=_str("REMUX_VIDEO_ENCODER", "libx264"),
+        remux_workers=max(1, _int("REMUX_WORKERS", max(1, (os.cpu_count() or 2) // 2))),
+        remux_timeout=_float("REMUX_TIMEOUT", 600),
+        ffmpeg_bin=_str("FFMPEG_BIN", "xtra"),
+        ffprobe_bin=_str("FFPROBE_BIN", "ffprobe"),
+        trace_file=_str("TRACE_FILE", "traces.jsonl"),
+        trace_max_bytes=max(1024, _int("TRACE_MAX_BYTES", 10 * 1024 * 1024)),
+        trace_backups=max(0, _int("TRACE_BACKUPS", 5)),
+        perf_lag_interval=_float("PERF_LAG_INTERVAL", 0.5),
+        perf_slow_callback_ms=_float("PERF_SLOW_CALLBACK_MS", 250),
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    return _load()
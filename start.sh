@@ -10,25 +10,25 @@ if [ -d "/opt/venv" ]; then
   source /opt/venv/bin/activate
 fi
 
-# Start aria2 in background; ignore failure
-if command -v aria2c >/dev/null 2>&1; then
-  aria2c --enable-rpc \
-         --rpc-listen-all=false \
-         --rpc-allow-origin-all \
-         --daemon=true \
-         --max-tries=50 \
-         --retry-wait=3 \
-         --continue=true \
-         --min-split-size=4M \
-         --split=10 \
-         --allow-overwrite=true || true
-  echo "[start.sh] aria2c started (background)"
-else
-  echo "[start.sh] WARNING: aria2c not found in PATH"
+# aria2 is normally started and supervised by the bot itself (aria2_pool.py).
+# Only launch one here when ARIA2_MANAGED=false.
+if [ "${ARIA2_MANAGED:-true}" = "false" ]; then
+  if command -v aria2c >/dev/null 2>&1; then
+    aria2c --enable-rpc \
+           --rpc-listen-all=false \
+           --rpc-allow-origin-all \
+           --daemon=true \
+           --max-tries=50 \
+           --retry-wait=3 \
+           --continue=true \
+           --disk-cache="${ARIA2_DISK_CACHE:-64M}" \
+           --allow-overwrite=true || true
+    echo "[start.sh] aria2c started (background)"
+  else
+    echo "[start.sh] WARNING: aria2c not found in PATH"
+  fi
+  # No sleep needed: the bot retries the RPC connection with backoff
 fi
 
-# give aria2 a moment to come online
-sleep 2
-
 # Exec the bot (PID 1 will be python process)
 exec python3 terabox.py
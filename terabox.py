@@ -1,25 +1,35 @@
-from aria2p import API as Aria2API, Client as Aria2Client
+import time
+
+# Measured from interpreter start to "ready" (see main())
+PROCESS_START = time.perf_counter()
+
 import asyncio
 from datetime import datetime
+import io
 import os
 import logging
 import math
-import time
 import urllib.parse
 from urllib.parse import urlparse, unquote
+from threading import Thread
 
-import requests
-from pyrogram import Client, filters
+from pyrogram import Client, filters, idle
 from pyrogram.types import (
+    CallbackQuery,
+    InlineQuery,
+    InlineQueryResultCachedAnimation,
+    InlineQueryResultCachedAudio,
+    InlineQueryResultCachedDocument,
+    InlineQueryResultCachedPhoto,
+    InlineQueryResultCachedVideo,
     Message,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
 )
 from pyrogram.enums import ChatMemberStatus
-from pyrogram.errors import FloodWait, RPCError
+from pyrogram.errors import FloodWait, MessageIdInvalid, RPCError
 
-from flask import Flask, render_template
-from threading import Thread
+from settings import get_settings
 
 # -------------------------------------------------
 # Pyrogram ID limits fix (for very large negative IDs)
@@ -45,28 +55,72 @@ logging.getLogger("pyrogram.connection").setLevel(logging.ERROR)
 logging.getLogger("pyrogram.dispatcher").setLevel(logging.ERROR)
 
 # -------------------------------------------------
-# aria2 RPC
+# ENV vars (parsed and validated in settings.py)
 # -------------------------------------------------
-aria2 = Aria2API(
-    Aria2Client(
-        host="http://localhost",
-        port=6800,
-        secret=""
-    )
+settings = get_settings()
+
+API_ID = settings.api_id
+API_HASH = settings.api_hash
+BOT_TOKEN = settings.bot_token
+DUMP_CHAT_ID = settings.dump_chat_id
+FSUB_ID = settings.fsub_id
+USER_SESSION_STRING = settings.user_session_string
+
+# Telegram user IDs allowed to use admin commands like /perf
+OWNER_IDS = settings.owner_ids
+
+# Token required for the /perf HTTP endpoints (disabled when empty)
+PERF_TOKEN = settings.perf_token
+
+def _mask(s: str, keep: int = 4) -> str:
+    if not s:
+        return ""
+    if len(s) <= keep * 2:
+        return s
+    return s[:keep] + "..." + s[-keep:]
+
+logger.info(
+    "Loaded ENV:\n"
+    f"  TELEGRAM_API = {API_ID}\n"
+    f"  TELEGRAM_HASH = { _mask(API_HASH, 6) }\n"
+    f"  BOT_TOKEN = { _mask(BOT_TOKEN, 6) }\n"
+    f"  DUMP_CHAT_ID = {DUMP_CHAT_ID}\n"
+    f"  FSUB_ID = {FSUB_ID}"
 )
 
+# Our own modules read settings at import, so they come after logging setup
+import aria2_tuning
+import perf
+import remux
+import tracing
+from aria2_pool import Aria2Pool
+from dumpindex import index as dump_index
+from hoststats import backend_key, host_key, stats
+
+# -------------------------------------------------
+# aria2 RPC (self-managed daemon pool, see aria2_pool.py)
+# -------------------------------------------------
+# Only job-independent options live here; split / connections / allocation
+# are picked per download by aria2_tuning.
 ARIA2_OPTS = {
     "max-tries": "50",
     "retry-wait": "3",
     "continue": "true",
     "allow-overwrite": "true",
-    "min-split-size": "4M",
-    "split": "10"
+    "disk-cache": settings.aria2_disk_cache,
 }
-try:
-    aria2.set_global_options(ARIA2_OPTS)
-except Exception as e:
-    logger.error(f"Failed to set aria2 global options: {e}")
+aria2_pool = Aria2Pool.from_settings(settings, ARIA2_OPTS)
+
+# How long a job waits for a crashed aria2 to come back before giving up
+ARIA2_RECOVERY_TIMEOUT = 60
+
+# Read size for files streamed straight into memory (see fetch_to_memory)
+STREAM_CHUNK_SIZE = 256 * 1024
+# Headroom over the resolver's size when reserving memory for a buffer
+STREAM_SIZE_SLACK = 1024 * 1024
+# Bytes of in-memory buffers currently reserved by jobs, out of
+# STREAM_MEMORY_BUDGET (only touched from the event loop)
+stream_memory_used = 0
 
 # -------------------------------------------------
 # Supported domains text (for error message)
@@ -103,80 +157,25 @@ SUPPORTED_DOMAINS_TEXT = (
 # This is used for URL checking (same list as above)
 VALID_DOMAINS = SUPPORTED_DOMAINS_LIST.copy()
 
-# -------------------------------------------------
-# ENV vars
-# -------------------------------------------------
-API_ID = os.environ.get("TELEGRAM_API", "")
-if not API_ID:
-    logger.error("TELEGRAM_API variable is missing! Exiting now")
-    raise SystemExit(1)
-
-API_HASH = os.environ.get("TELEGRAM_HASH", "")
-if not API_HASH:
-    logger.error("TELEGRAM_HASH variable is missing! Exiting now")
-    raise SystemExit(1)
-
-BOT_TOKEN = os.environ.get("BOT_TOKEN", "")
-if not BOT_TOKEN:
-    logger.error("BOT_TOKEN variable is missing! Exiting now")
-    raise SystemExit(1)
-
-DUMP_CHAT_ID_RAW = os.environ.get("DUMP_CHAT_ID", "")
-if not DUMP_CHAT_ID_RAW:
-    logger.error("DUMP_CHAT_ID variable is missing! Exiting now")
-    raise SystemExit(1)
-try:
-    DUMP_CHAT_ID = int(DUMP_CHAT_ID_RAW)
-except ValueError:
-    logger.error(f"DUMP_CHAT_ID must be integer, got: {DUMP_CHAT_ID_RAW}")
-    raise SystemExit(1)
-
-FSUB_ID = os.environ.get("FSUB_ID", "")
-if not FSUB_ID:
-    logger.error("FSUB_ID variable is missing! Exiting now")
-    raise SystemExit(1)
-
-USER_SESSION_STRING = os.environ.get("USER_SESSION_STRING", "")
-if not USER_SESSION_STRING:
-    logger.info("USER_SESSION_STRING variable is missing! Bot will split files in 2 GB…")
-    USER_SESSION_STRING = None
-
-def _mask(s: str, keep: int = 4) -> str:
-    if not s:
-        return ""
-    if len(s) <= keep * 2:
-        return s
-    return s[:keep] + "..." + s[-keep:]
-
-logger.info(
-    "Loaded ENV:\n"
-    f"  TELEGRAM_API = {API_ID}\n"
-    f"  TELEGRAM_HASH = { _mask(API_HASH, 6) }\n"
-    f"  BOT_TOKEN = { _mask(BOT_TOKEN, 6) }\n"
-    f"  DUMP_CHAT_ID = {DUMP_CHAT_ID} (raw='{DUMP_CHAT_ID_RAW}')\n"
-    f"  FSUB_ID = {FSUB_ID}"
-)
-
 # -------------------------------------------------
 # Pyrogram clients
 # -------------------------------------------------
-app = Client("jetbot", api_id=int(API_ID), api_hash=API_HASH, bot_token=BOT_TOKEN)
+app = Client("jetbot", api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN)
 
 user = None
-SPLIT_SIZE = 2 * 1024 * 1024 * 1024  # ~2 GB
+SPLIT_SIZE = settings.split_size
 if USER_SESSION_STRING:
-    user = Client("jetu", api_id=int(API_ID), api_hash=API_HASH, session_string=USER_SESSION_STRING)
-    SPLIT_SIZE = 4 * 1024 * 1024 * 1024  # ~4 GB
+    user = Client("jetu", api_id=API_ID, api_hash=API_HASH, session_string=USER_SESSION_STRING)
 
 # -------------------------------------------------
 # Tera API (NEW: teradl.tiiny.io)
 # -------------------------------------------------
-# You can still override via env TERA_API_URL if you want,
-# but by default it uses the new API you gave.
-TERA_API_BASE = os.environ.get(
-    "TERA_API_URL",
-    "https://teradl.tiiny.io/"
-)
+# You can still override via env TERA_API_URL if you want (comma separated
+# for several backends), but by default it uses the new API you gave.
+TERA_API_BACKENDS = settings.tera_api_urls
+
+# Set by main() once Telegram clients are up (readiness probe)
+BOT_READY = False
 
 # -------------------------------------------------
 # Helpers
@@ -199,6 +198,30 @@ def format_size(size: int) -> str:
     return f"{size / (1024 * 1024 * 1024):.2f} GB"
 
 
+def parse_size(text) -> int:
+    """
+    Parse a human size like "12.5 MB" / "1.2GB" / "734003" into bytes.
+    Returns 0 if it can't be parsed.
+    """
+    if isinstance(text, (int, float)):
+        return int(text)
+    if not isinstance(text, str):
+        return 0
+    units = {"B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3, "TB": 1024 ** 4}
+    t = text.strip().upper().replace(" ", "")
+    for unit in ("TB", "GB", "MB", "KB", "B"):
+        if t.endswith(unit):
+            t = t[: -len(unit)]
+            mult = units[unit]
+            break
+    else:
+        mult = 1
+    try:
+        return int(float(t) * mult)
+    except ValueError:
+        return 0
+
+
 def is_probably_media_url(u: str) -> bool:
     if not isinstance(u, str):
         return False
@@ -239,6 +262,20 @@ async def is_user_member(client: Client, user_id: int) -> bool:
         return False
 
 
+async def require_membership(client: Client, message: Message) -> bool:
+    """Force-subscribe check; tells the user to join if they aren't a member."""
+    if await is_user_member(client, message.from_user.id):
+        return True
+    join_url = f"https://t.me/{FSUB_ID.lstrip('@')}"
+    join_button = InlineKeyboardButton("ᴊᴏɪɴ ❤️🚀", url=join_url)
+    reply_markup = InlineKeyboardMarkup([[join_button]])
+    await message.reply_text(
+        "ʏᴏᴜ ᴍᴜsᴛ ᴊᴏɪɴ ᴍʏ ᴄʜᴀɴɴᴇʟ ᴛᴏ ᴜsᴇ ᴍᴇ.",
+        reply_markup=reply_markup
+    )
+    return False
+
+
 def pick_media_url_from_api(data: dict, original_url: str) -> str | None:
     """
     (Kept for compatibility, but NOT used by the new API anymore)
@@ -287,7 +324,27 @@ def pick_media_url_from_api(data: dict, original_url: str) -> str | None:
     return unique[0]
 
 
-def call_tera_api(share_url: str) -> tuple[str | None, bool]:
+def call_tera_api(share_url: str) -> tuple[str | None, int, bool]:
+    """
+    Resolve share_url with the configured backends, best first according to
+    their recorded latency / failure rate, until one of them succeeds.
+    Same return value as call_tera_backend.
+    Blocking, run it with asyncio.to_thread.
+    """
+    backends = {backend_key(urlparse(b).netloc): b for b in TERA_API_BACKENDS}
+    for key in stats.rank(list(backends)):
+        # With a single backend there is nothing to fail over to, so a
+        # shorter timeout could only turn slow resolves into failures
+        timeout = stats.suggest_timeout(key, default=25) if len(backends) > 1 else 25
+        started = time.time()
+        media_url, size, ok = call_tera_backend(backends[key], share_url, timeout=timeout)
+        stats.record(key, ok, ttfb=time.time() - started)
+        if ok:
+            return media_url, size, True
+    return None, 0, False
+
+
+def call_tera_backend(api_base: str, share_url: str, timeout: float = 25) -> tuple[str | None, int, bool]:
     """
     Call NEW terabox API:
       https://teradl.tiiny.io/?key=RushVx&link={link}
@@ -304,61 +361,65 @@ def call_tera_api(share_url: str) -> tuple[str | None, bool]:
       ]
     }
 
-    Returns (media_url, True) on success,
-    or (None, False) on failure / unsupported.
+    Returns (media_url, size_bytes, True) on success (size_bytes is 0 if
+    the API didn't report a usable size),
+    or (None, 0, False) on failure / unsupported.
     """
+    import requests
+
     try:
         encoded = urllib.parse.quote(share_url, safe="")
-        api_url = f"{TERA_API_BASE}?key=RushVx&link={encoded}"
+        api_url = f"{api_base}?key=RushVx&link={encoded}"
         logger.info(f"[API] Calling {api_url}")
-        resp = requests.get(api_url, timeout=25)
+        resp = requests.get(api_url, timeout=timeout)
 
         if resp.status_code != 200:
             logger.error(f"[API] Non-200 status: {resp.status_code}")
-            return None, False
+            return None, 0, False
 
         try:
             data = resp.json()
         except Exception:
             logger.error("[API] Response not JSON, treat as failure")
-            return None, False
+            return None, 0, False
 
         if not isinstance(data, dict):
             logger.error("[API] JSON root is not an object")
-            return None, False
+            return None, 0, False
 
         items = data.get("data")
         if not isinstance(items, list) or not items:
             logger.error("[API] 'data' array missing or empty")
-            return None, False
+            return None, 0, False
 
         first = items[0]
         if not isinstance(first, dict):
             logger.error("[API] First element in 'data' is not an object")
-            return None, False
+            return None, 0, False
 
         media_url = first.get("download") or first.get("url")
         if not media_url:
             logger.error("[API] 'download' field missing in first data item")
-            return None, False
+            return None, 0, False
 
         # We trust the API; don't over-filter with is_probably_media_url,
         # so images/docs/etc. also work.
-        logger.info(f"[API] Picked media URL: {media_url}")
-        return media_url, True
+        size = parse_size(first.get("size"))
+        logger.info(f"[API] Picked media URL: {media_url} (size={size})")
+        return media_url, size, True
 
     except Exception as e:
         logger.error(f"[API] Failed to call tera API: {e}")
-        return None, False
+        return None, 0, False
 
 
-async def safe_edit(message, text):
+async def safe_edit(message, text, reply_markup=None):
     try:
-        await message.edit_text(text)
+        await message.edit_text(text, reply_markup=reply_markup)
     except FloodWait as e:
         await asyncio.sleep(e.value)
         try:
-            await message.edit_text(text)
+            await message.edit_text(text, reply_markup=reply_markup)
         except Exception as ee:
             logger.error(f"Failed to edit after FloodWait: {ee}")
     except RPCError as e:
@@ -434,11 +495,141 @@ def is_image_ext(ext: str) -> bool:
     return ext in [".jpg", ".jpeg", ".png", ".gif", ".webp"]
 
 
+# -------------------------------------------------
+# Jobs (cancellation)
+# -------------------------------------------------
+class Job:
+    """One running link -> Telegram job, tracked so it can be cancelled."""
+
+    def __init__(self, user_id: int, trace: tracing.Trace):
+        # The trace id doubles as the job id, so logs and spans line up
+        self.id = trace.id
+        self.trace = trace
+        self.user_id = user_id
+        self.task: asyncio.Task | None = None
+        self.download = None  # aria2p Download while it's in aria2
+        self.temp_files: set[str] = set()
+        self.cancelled = False
+        self.outcome: dict = {}  # extra attributes for the root "job" span
+        self.memory_reserved = 0  # share of STREAM_MEMORY_BUDGET held by this job
+
+
+JOBS: dict[str, Job] = {}
+# Jobs running at once; the rest wait in run_job (FIFO) for a free slot
+JOB_SLOTS = asyncio.Semaphore(settings.max_concurrent_jobs)
+
+
+def cancel_markup(job_id: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[InlineKeyboardButton("✖️ ᴄᴀɴᴄᴇʟ", callback_data=f"cancel:{job_id}")]])
+
+
+async def wait_or_kill(proc, awaitable):
+    """Await a subprocess call, killing the process if the job is cancelled."""
+    try:
+        return await awaitable
+    except asyncio.CancelledError:
+        if proc.returncode is None:
+            proc.kill()
+        raise
+
+
+async def cancel_job(job: Job):
+    """Stop a job everywhere it may be holding resources."""
+    job.cancelled = True
+    download = job.download
+    if job.task is not None:
+        # Cancel first, so the poll loop can't see the removal below and
+        # report it as a failed download. Interrupts the poll loop / split /
+        # remux (subprocesses get killed) and aborts the upload in progress
+        job.task.cancel()
+    if download is not None:
+        # Free the aria2 slot and bandwidth now, and drop the partial file
+        await asyncio.to_thread(aria2_pool.remove, download)
+
+
+# -------------------------------------------------
+# Dump-chat cache (inline mode / deep links, see dumpindex.py)
+# -------------------------------------------------
+def cached_title(entry: dict, part: int) -> str:
+    title = entry["title"]
+    if entry["parts"] > 1:
+        title += f" (Part {part}/{entry['parts']})"
+    return title
+
+
+def inline_result(entry: dict, part: int, msg: dict, reply_markup):
+    """Cached inline result for one part of an indexed upload."""
+    title = cached_title(entry, part)
+    common = {"id": f"{entry['token']}:{part}", "caption": f"✨ {title}", "reply_markup": reply_markup}
+    described = {"title": title, "description": format_size(msg.get("size", 0)), **common}
+
+    if msg["kind"] == "video":
+        return InlineQueryResultCachedVideo(video_file_id=msg["file_id"], **described)
+    if msg["kind"] == "photo":
+        return InlineQueryResultCachedPhoto(photo_file_id=msg["file_id"], **described)
+    if msg["kind"] == "audio":
+        return InlineQueryResultCachedAudio(audio_file_id=msg["file_id"], **common)
+    if msg["kind"] == "animation":
+        return InlineQueryResultCachedAnimation(animation_file_id=msg["file_id"], title=title, **common)
+    return InlineQueryResultCachedDocument(document_file_id=msg["file_id"], **described)
+
+
+def deep_link(token: str) -> str:
+    return f"https://t.me/{app.me.username}?start={token}"
+
+
+async def send_cached(chat_id: int, entry: dict) -> bool:
+    """
+    Copy every part of an indexed upload from the dump chat to chat_id.
+    The entry is only dropped when its messages are really gone; other
+    failures (FloodWait is waited out once) leave it for the next request.
+    """
+    parts = sorted(entry["messages"])
+    done = 0
+    gone = False
+    for attempt in range(2):
+        try:
+            ids = [entry["messages"][p]["id"] for p in parts[done:]]
+            messages = await app.get_messages(DUMP_CHAT_ID, ids)
+            if any(m is None or m.empty for m in messages):
+                gone = True
+                break
+            for part, dump_message in zip(parts[done:], messages):
+                # Fresh caption: the dump one names the user who first sent the link
+                await dump_message.copy(chat_id, caption=f"✨ {cached_title(entry, part)}")
+                done += 1
+            return True
+        except FloodWait as e:
+            if attempt:
+                break
+            await asyncio.sleep(e.value)
+        except MessageIdInvalid:
+            gone = True
+            break
+        except Exception as e:
+            logger.warning(f"[INDEX] Cached copy of {entry['link']} failed: {e}")
+            break
+
+    if gone:
+        logger.warning(f"[INDEX] {entry['link']} is gone from the dump chat, dropping it")
+        dump_index.remove(entry["token"])
+    return False
+
+
 # -------------------------------------------------
 # Bot commands
 # -------------------------------------------------
 @app.on_message(filters.command("start") & filters.private)
 async def start_command(client: Client, message: Message):
+    # Deep link: /start <token> -> send that cached upload
+    if len(message.command) > 1 and message.from_user:
+        if not await require_membership(client, message):
+            return
+        entry = dump_index.get(message.command[1])
+        if not entry or not await send_cached(message.chat.id, entry):
+            await message.reply_text("❌ This file is no longer available, send me the link again.")
+        return
+
     join_button = InlineKeyboardButton("ᴊᴏɪɴ ❤️🚀", url="https://t.me/xenondownloader")
     developer_button = InlineKeyboardButton("ᴅᴇᴠᴇʟᴏᴘᴇʀ ⚡️", url="https://t.me/Lux_Eren")
     repo_btn = InlineKeyboardButton("ʜᴀɴɪᴍᴇ ᴄʜᴀɴɴᴇʟ 🌐", url="https://t.me/+KttPZhEPnVozMTk1")
@@ -465,6 +656,68 @@ async def start_command(client: Client, message: Message):
         await message.reply_text(final_msg, reply_markup=reply_markup)
 
 
+@app.on_callback_query(filters.regex(r"^cancel:"))
+async def cancel_callback(client: Client, query: CallbackQuery):
+    job = JOBS.get(query.data.split(":", 1)[1])
+    if job is None:
+        await query.answer("This job has already finished.")
+        return
+    if query.from_user.id != job.user_id and query.from_user.id not in OWNER_IDS:
+        await query.answer("This is not your job.", show_alert=True)
+        return
+    if not job.cancelled:
+        await cancel_job(job)
+    await query.answer("Cancelling...")
+
+
+@app.on_inline_query()
+async def inline_query(client: Client, query: InlineQuery):
+    entries = dump_index.search(query.query)
+    await dump_index.resolve_file_ids(app, DUMP_CHAT_ID, entries)
+
+    results = []
+    for entry in entries:
+        entry = dump_index.get(entry["token"]) or entry
+        button = InlineKeyboardMarkup([[InlineKeyboardButton("📥 ɢᴇᴛ ɪɴ ᴘᴍ", url=deep_link(entry["token"]))]])
+        for part, msg in sorted(entry["messages"].items()):
+            if msg.get("file_id"):
+                results.append(inline_result(entry, part, msg, button))
+
+    # Telegram accepts at most 50 results per answer
+    await query.answer(results[:50], cache_time=30)
+
+
+@app.on_message(filters.chat(DUMP_CHAT_ID) & (filters.video | filters.document | filters.photo | filters.audio))
+async def dump_chat_post(client: Client, message: Message):
+    # Uploads made by the user session reach the bot as channel posts
+    dump_index.add_message(message)
+
+
+@app.on_message(filters.command("perf") & filters.private)
+async def perf_command(client: Client, message: Message):
+    """
+    /perf               -> event loop lag + recent slow callbacks
+    /perf profile [sec] -> sampling profile of the loop thread
+    """
+    if not message.from_user or message.from_user.id not in OWNER_IDS:
+        return
+
+    args = message.command[1:]
+    if args and args[0] == "profile":
+        seconds = 10.0
+        if len(args) > 1:
+            try:
+                seconds = min(60.0, max(1.0, float(args[1])))
+            except ValueError:
+                pass
+        status = await message.reply_text(f"🔬 Profiling for {seconds:.0f}s...")
+        prof = await asyncio.to_thread(perf.monitor.sample, seconds)
+        await safe_edit(status, f"```\n{perf.format_profile(prof)}\n```")
+        return
+
+    await message.reply_text(f"```\n{perf.format_snapshot(perf.monitor.snapshot())}\n```")
+
+
 # -------------------------------------------------
 # Main handler (all non-command text in private)
 # -------------------------------------------------
@@ -477,18 +730,14 @@ async def handle_message(client: Client, message: Message):
         return
 
     user_id = message.from_user.id
+    trace = tracing.Trace(user=user_id)
 
     # Force-subscribe check
-    if not await is_user_member(client, user_id):
-        join_url = f"https://t.me/{FSUB_ID.lstrip('@')}"
-        join_button = InlineKeyboardButton("ᴊᴏɪɴ ❤️🚀", url=join_url)
-        reply_markup = InlineKeyboardMarkup([[join_button]])
-        await message.reply_text(
-            "ʏᴏᴜ ᴍᴜsᴛ ᴊᴏɪɴ ᴍʏ ᴄʜᴀɴɴᴇʟ ᴛᴏ ᴜsᴇ ᴍᴇ.",
-            reply_markup=reply_markup
-        )
-        return
-
+    with trace.span("fsub") as span:
+        if not await require_membership(client, message):
+            span["status"] = "not_member"
+            trace.finish("not_member")
+            return
 
     # Extract raw URL and check support
     raw_url = None
@@ -503,91 +752,350 @@ async def handle_message(client: Client, message: Message):
 
     if not raw_url:
         await message.reply_text("Please provide a Terabox link.")
+        trace.finish("no_link")
         return
 
     if not url:
         await message.reply_text(SUPPORTED_DOMAINS_TEXT)
+        trace.finish("unsupported")
         return
 
-    status_message = await message.reply_text("sᴇɴᴅɪɴɢ ʏᴏᴜ ᴛʜᴇ ᴍᴇᴅɪᴀ...🤤")
+    # Already in the dump chat? Answer from there, no download needed
+    cached = dump_index.lookup_link(url)
+    if cached:
+        with trace.span("copy_message", cached=True, parts=cached["parts"]) as span:
+            sent = await send_cached(message.chat.id, cached)
+            if not sent:
+                span["status"] = "failed"
+        if sent:
+            trace.finish("cached")
+            return
+
+    job = Job(user_id, trace)
+    status_message = await message.reply_text(
+        "sᴇɴᴅɪɴɢ ʏᴏᴜ ᴛʜᴇ ᴍᴇᴅɪᴀ...🤤",
+        reply_markup=cancel_markup(job.id)
+    )
+    JOBS[job.id] = job
+    # Not awaited: the handler returns so this dispatcher worker stays free
+    # for cancel buttons, /perf and inline queries while the job runs
+    job.task = asyncio.create_task(run_job(client, message, url, status_message, job))
 
-    # 1) Call NEW API
-    media_url, ok = call_tera_api(url)
-    if not ok or not media_url:
-        await safe_edit(status_message, SUPPORTED_DOMAINS_TEXT)
-        return
 
-    # 2) Add to aria2
+async def run_job(client: Client, message: Message, url: str, status_message: Message, job: Job):
+    """Run one job to the end, then clean up after it whatever happened."""
+    status = "ok"
     try:
-        download = aria2.add_uris([media_url])
+        if JOB_SLOTS.locked():
+            await safe_edit(status_message, "⏳ ǫᴜᴇᴜᴇᴅ, ᴡᴀɪᴛɪɴɢ ғᴏʀ ᴀ ғʀᴇᴇ sʟᴏᴛ...", reply_markup=cancel_markup(job.id))
+        with job.trace.span("queue_wait", queue="jobs"):
+            await JOB_SLOTS.acquire()
+        # Released on any exit, cancel included, so the next job gets the slot
+        try:
+            await process_link(client, message, url, status_message, job)
+        finally:
+            JOB_SLOTS.release()
+        # process_link reports failures it handled itself (resolve_failed, ...)
+        status = job.outcome.pop("result", "ok")
+    except asyncio.CancelledError:
+        status = "cancelled"
+        if not job.cancelled:
+            raise
+        logger.info(f"[JOB {job.id}] Cancelled by user {job.user_id}")
+        await safe_edit(status_message, "✖️ ᴄᴀɴᴄᴇʟʟᴇᴅ.")
     except Exception as e:
-        logger.error(f"aria2.add_uris failed: {e}")
-        await safe_edit(status_message, f"❌ Failed to start download:\n`{e}`")
-        return
+        status = "error"
+        logger.error(f"[JOB {job.id}] Failed: {e}")
+        await safe_edit(status_message, f"❌ Failed:\n`{e}`")
+    finally:
+        JOBS.pop(job.id, None)
+        release_stream_memory(job)
+        with job.trace.span("cleanup", files=len(job.temp_files)):
+            for path in job.temp_files:
+                if os.path.exists(path):
+                    try:
+                        os.remove(path)
+                    except Exception:
+                        pass
+        job.trace.finish(status, **job.outcome)
+
+
+def filename_from_response(resp, url: str) -> str:
+    """Best-effort filename from Content-Disposition, else the URL path."""
+    disposition = resp.headers.get("Content-Disposition", "")
+    for part in disposition.split(";"):
+        part = part.strip()
+        if part.lower().startswith("filename*="):
+            value = part.split("=", 1)[1].strip('"')
+            if "''" in value:
+                value = value.split("''", 1)[1]
+            return clean_download_name(value)
+        if part.lower().startswith("filename="):
+            return clean_download_name(part.split("=", 1)[1].strip('"'))
+    return clean_download_name(urlparse(url).path) or "file"
+
+
+def reserve_stream_memory(job: Job, size: int) -> bool:
+    """Claim `size` bytes of the in-memory budget for a job, if there's room."""
+    global stream_memory_used
+    if stream_memory_used + size > settings.stream_memory_budget:
+        return False
+    stream_memory_used += size
+    job.memory_reserved += size
+    return True
 
-    start_time = datetime.now()
 
-    # 3) Poll download
-    while True:
-        await asyncio.sleep(5)
-        try:
-            download.update()
-        except Exception as e:
-            logger.error(f"Download update failed: {e}")
-            break
+def release_stream_memory(job: Job):
+    global stream_memory_used
+    stream_memory_used -= job.memory_reserved
+    job.memory_reserved = 0
 
-        if download.is_complete:
-            break
 
-        if download.is_removed or download.status == "error":
-            logger.error(f"Download failed/removed. Status={download.status}")
-            await safe_edit(status_message, "❌ Download failed or was removed.")
-            return
+def fetch_to_memory(url: str, max_size: int, job: Job) -> tuple[io.BytesIO, str, int] | None:
+    """
+    Download a small file straight into memory: no aria2 RPC, no disk.
+    The buffer never grows past max_size; if the body turns out bigger,
+    or anything fails, returns None so the caller falls back to aria2.
+    Blocking, run it with asyncio.to_thread.
+    """
+    import requests
 
-        total = download.total_length or 0
-        completed = download.completed_length or 0
-        progress = completed * 100 / total if total > 0 else 0.0
+    host = urlparse(url).netloc
+    started = time.time()
+    buf = io.BytesIO()
+    timeout = stats.suggest_timeout(host_key(host), default=25)
+    try:
+        with requests.get(url, stream=True, timeout=timeout) as resp:
+            ttfb = resp.elapsed.total_seconds()
+            if resp.status_code != 200:
+                logger.warning(f"[STREAM] Non-200 status {resp.status_code}, falling back to aria2")
+                aria2_tuning.record_outcome(host, 0, 0, 1, ok=False, ttfb=ttfb)
+                return None
+            length = int(resp.headers.get("Content-Length") or 0)
+            if length > max_size:
+                logger.info(f"[STREAM] Content-Length {length} over limit, falling back to aria2")
+                return None
+            for chunk in resp.iter_content(STREAM_CHUNK_SIZE):
+                if job.cancelled:
+                    return None
+                buf.write(chunk)
+                if buf.tell() > max_size:
+                    logger.info("[STREAM] Body larger than reported, falling back to aria2")
+                    return None
+            name = filename_from_response(resp, url)
+    except Exception as e:
+        logger.warning(f"[STREAM] Failed, falling back to aria2: {e}")
+        aria2_tuning.record_outcome(host, 0, 0, 1, ok=False)
+        return None
 
-        elapsed_time = datetime.now() - start_time
-        elapsed_minutes, elapsed_seconds = divmod(elapsed_time.seconds, 60)
+    size = buf.tell()
+    buf.name = name  # Pyrogram takes the upload filename from here
+    buf.seek(0)
+    aria2_tuning.record_outcome(host, size, time.time() - started, 1, ok=True, ttfb=ttfb)
+    logger.info(f"[STREAM] Fetched {name} ({format_size(size)}) into memory")
+    return buf, name, size
+
+
+async def download_to_disk(
+    message: Message,
+    status_message: Message,
+    job: Job,
+    media_url: str,
+    api_size: int,
+) -> tuple[str, str, int] | None:
+    """
+    Download media_url with aria2, showing progress on status_message.
+    Returns (file_path, display_name, file_size), or None after telling
+    the user why it failed.
+    """
+    user_id = message.from_user.id
 
-        bar_filled = int(progress / 10)
-        bar = "★" * bar_filled + "☆" * (10 - bar_filled)
+    # Add to aria2 (options tuned for this size / host)
+    media_host = urlparse(media_url).netloc
+    _, aria2_options = aria2_tuning.pick_options(api_size, media_host)
+    # A single URI, so aria2 opens at most max-connection-per-server
+    connections = int(aria2_options["max-connection-per-server"])
+    # Queue wait: engine start-up plus time aria2 keeps us "waiting" for a
+    # download slot (only as precise as the poll interval)
+    queued_at = time.time()
+    if not await asyncio.to_thread(aria2_pool.wait_ready, settings.aria2_ready_timeout):
+        job.trace.add("queue_wait", queued_at, time.time(), status="engine_down")
+        await safe_edit(status_message, "❌ Download engine is not available right now.")
+        return None
+    try:
+        download = await asyncio.to_thread(aria2_pool.add_uris, [media_url], options=aria2_options)
+    except Exception as e:
+        logger.error(f"aria2.add_uris failed: {e}")
+        await safe_edit(status_message, f"❌ Failed to start download:\n`{e}`")
+        return None
+    job.download = download
 
-        status_text = (
-            f"┏ ғɪʟᴇɴᴀᴍᴇ: {download.name or 'Unknown'}\n"
-            f"┠ [{bar}] {progress:.2f}%\n"
-            f"┠ ᴘʀᴏᴄᴇssᴇᴅ: {format_size(completed)} ᴏғ {format_size(total)}\n"
-            f"┠ sᴛᴀᴛᴜs: 📥 Downloading\n"
-            f"┠ ᴇɴɢɪɴᴇ: <b><u>Aria2c v1.37.0</u></b>\n"
-            f"┠ sᴘᴇᴇᴅ: {format_size(download.download_speed)}/s\n"
-            f"┠ ᴇɴɢɪɴᴇ: <b><u>Aria2c v1.37.0</u></b>\n"
-            f"┠ ᴇᴛᴀ: {download.eta} | ᴇʟᴀᴘsᴇᴅ: {elapsed_minutes}m {elapsed_seconds}s\n"
-            f"┖ ᴜsᴇʀ: <a href='tg://user?id={user_id}'>{message.from_user.first_name}</a> | ɪᴅ: {user_id}\n"
-        )
+    start_time = datetime.now()
+
+    # Poll download
+    ttfb = None  # only as precise as the poll interval
+    try:
+        update_failed_since = None
+        while True:
+            await asyncio.sleep(5)
+            try:
+                # aria2p RPC is blocking; a hung daemon must not stall the loop
+                await asyncio.to_thread(download.update)
+                update_failed_since = None
+                if queued_at is not None and download.status != "waiting":
+                    job.trace.add("queue_wait", queued_at, time.time(), gid=download.gid)
+                    queued_at = None
+            except Exception as e:
+                # aria2 may be restarting; the pool re-adds this GID when it's back
+                now = time.time()
+                update_failed_since = update_failed_since or now
+                if now - update_failed_since < ARIA2_RECOVERY_TIMEOUT:
+                    logger.warning(f"Download update failed, waiting for aria2: {e}")
+                    continue
+                logger.error(f"Download update failed: {e}")
+                await safe_edit(status_message, "❌ Download engine is not responding.")
+                return None
+
+            if download.is_complete:
+                break
 
-        await safe_edit(status_message, status_text)
+            if download.is_removed or download.status == "error":
+                logger.error(f"Download failed/removed. Status={download.status}")
+                if download.status == "error":
+                    aria2_tuning.record_outcome(media_host, api_size, 0, connections, ok=False, ttfb=ttfb)
+                await safe_edit(status_message, "❌ Download failed or was removed.")
+                return None
+
+            total = download.total_length or 0
+            completed = download.completed_length or 0
+            if ttfb is None and completed > 0:
+                ttfb = (datetime.now() - start_time).total_seconds()
+            progress = completed * 100 / total if total > 0 else 0.0
+
+            elapsed_time = datetime.now() - start_time
+            elapsed_minutes, elapsed_seconds = divmod(elapsed_time.seconds, 60)
+
+            bar_filled = int(progress / 10)
+            bar = "★" * bar_filled + "☆" * (10 - bar_filled)
+
+            status_text = (
+                f"┏ ғɪʟᴇɴᴀᴍᴇ: {download.name or 'Unknown'}\n"
+                f"┠ [{bar}] {progress:.2f}%\n"
+                f"┠ ᴘʀᴏᴄᴇssᴇᴅ: {format_size(completed)} ᴏғ {format_size(total)}\n"
+                f"┠ sᴛᴀᴛᴜs: 📥 Downloading\n"
+                f"┠ ᴇɴɢɪɴᴇ: <b><u>Aria2c v1.37.0</u></b>\n"
+                f"┠ sᴘᴇᴇᴅ: {format_size(download.download_speed)}/s\n"
+                f"┠ ᴇɴɢɪɴᴇ: <b><u>Aria2c v1.37.0</u></b>\n"
+                f"┠ ᴇᴛᴀ: {download.eta} | ᴇʟᴀᴘsᴇᴅ: {elapsed_minutes}m {elapsed_seconds}s\n"
+                f"┖ ᴜsᴇʀ: <a href='tg://user?id={user_id}'>{message.from_user.first_name}</a> | ɪᴅ: {user_id}\n"
+            )
 
-    # 4) Download finished
+            await safe_edit(status_message, status_text, reply_markup=cancel_markup(job.id))
+    finally:
+        aria2_pool.forget(download.gid)
+        job.download = None
+        if queued_at is not None:
+            job.trace.add("queue_wait", queued_at, time.time(), status="aborted", gid=download.gid)
+
+    # Download finished
     if not download.files:
         await safe_edit(status_message, "❌ Download finished but no files found.")
-        return
+        return None
 
     file_path = download.files[0].path
     if not os.path.exists(file_path):
         await safe_edit(status_message, "❌ Downloaded file not found on disk.")
-        return
+        return None
 
+    job.temp_files.add(file_path)
     file_size = os.path.getsize(file_path)
+    aria2_tuning.record_outcome(
+        media_host,
+        file_size,
+        (datetime.now() - start_time).total_seconds(),
+        connections,
+        ok=True,
+        ttfb=ttfb,
+    )
 
     # Normalize filename (keep original extension, fix .mp4.mkv)
     file_path, display_name = normalize_download_path(file_path)
+    job.temp_files.add(file_path)
+    return file_path, display_name, file_size
+
+
+async def process_link(client: Client, message: Message, url: str, status_message: Message, job: Job):
+    """Resolve, download and upload one link. Runs as its own task so it can be cancelled."""
+    user_id = message.from_user.id
+
+    trace = job.trace
+
+    # 1) Call NEW API
+    with trace.span("resolve") as span:
+        media_url, api_size, ok = await asyncio.to_thread(call_tera_api, url)
+        span["size"] = api_size
+        if not ok or not media_url:
+            span["status"] = "failed"
+    if not ok or not media_url:
+        job.outcome["result"] = "resolve_failed"
+        await safe_edit(status_message, SUPPORTED_DOMAINS_TEXT)
+        return
+
+    # 2) Fetch: small files straight into memory, everything else via aria2
+    start_time = datetime.now()
+    fetched = None
+    # The reservation is held until the job ends, since the buffer lives
+    # through the upload; when the budget is used up, aria2 takes the file
+    reserve = min(settings.stream_upload_max_size, api_size + STREAM_SIZE_SLACK)
+    if 0 < api_size <= settings.stream_upload_max_size and reserve_stream_memory(job, reserve):
+        with trace.span("download", engine="memory", host=urlparse(media_url).netloc) as span:
+            fetched = await asyncio.to_thread(fetch_to_memory, media_url, reserve, job)
+            if fetched is None:
+                span["status"] = "fallback"
+                release_stream_memory(job)
+    if fetched is None:
+        with trace.span("download", engine="aria2", host=urlparse(media_url).netloc) as span:
+            fetched = await download_to_disk(message, status_message, job, media_url, api_size)
+            if fetched is None:
+                span["status"] = "failed"
+        if fetched is None:
+            job.outcome["result"] = "download_failed"
+            return
+    file_path, display_name, file_size = fetched
+    job.outcome["size"] = file_size
     ext = get_extension(display_name)
+    in_memory = isinstance(file_path, io.BytesIO)
+
+    # Containers Telegram can't stream: remux to faststart MP4, or fall
+    # back to sending the original as a document if that's not possible
+    upload_as_document = False
+    if in_memory and is_video_ext(ext) and remux.needs_remux(ext):
+        # Too small to be worth a disk round-trip just to remux
+        upload_as_document = True
+    elif is_video_ext(ext) and remux.needs_remux(ext):
+        await safe_edit(status_message, f"🔄 Converting {display_name} to MP4...", reply_markup=cancel_markup(job.id))
+        job.temp_files.add(os.path.splitext(file_path)[0] + ".mp4")
+        with trace.span("remux", ext=ext) as span:
+            mp4_path = await remux.remux_to_mp4(file_path)
+            if not mp4_path:
+                span["status"] = "fallback"
+        if mp4_path:
+            try:
+                os.remove(file_path)
+            except Exception:
+                pass
+            file_path = mp4_path
+            display_name = os.path.splitext(display_name)[0] + ".mp4"
+            ext = ".mp4"
+            file_size = os.path.getsize(file_path)
+        else:
+            upload_as_document = True
 
     caption = (
         f"✨ {display_name}\n"
         f"👤 ʟᴇᴇᴄʜᴇᴅ ʙʏ : <a href='tg://user?id={user_id}'>{message.from_user.first_name}</a>\n"
-        f"📥 ᴜsᴇʀ ʟɪɴᴋ: tg://user?id={user_id}\n\n"
+        f"📥 ᴜsᴇʀ ʟɪɴᴋ: tg://user?id={user_id}\n"
+        f"🔗 ʟɪɴᴋ: {url}\n\n"
         "[ᴘᴏᴡᴇʀᴇᴅ ʙʏ 𝙭𝙚𝙣𝙤𝙣 ᴅᴏᴡɴʟᴏᴀᴅᴇʀ 👾](https://t.me/xenondownloader)"
     )
 
@@ -598,10 +1106,13 @@ async def handle_message(client: Client, message: Message):
         nonlocal last_update_time
         now = time.time()
         if now - last_update_time >= UPDATE_INTERVAL:
-            await safe_edit(status_message, text)
+            await safe_edit(status_message, text, reply_markup=cancel_markup(job.id))
             last_update_time = now
 
     async def upload_progress(current, total):
+        if job.cancelled:
+            # Pyrogram's supported way to abort an upload in flight
+            app.stop_transmission()
         progress = (current / total) * 100 if total else 0
         elapsed_time = datetime.now() - start_time
         elapsed_minutes, elapsed_seconds = divmod(elapsed_time.seconds, 60)
@@ -636,7 +1147,7 @@ async def handle_message(client: Client, message: Message):
                 stdout=asyncio.subprocess.PIPE,
                 stderr=asyncio.subprocess.PIPE
             )
-            stdout, _ = await proc.communicate()
+            stdout, _ = await wait_or_kill(proc, proc.communicate())
             total_duration = float(stdout.decode().strip())
 
             file_size_local = os.path.getsize(input_path)
@@ -668,8 +1179,9 @@ async def handle_message(client: Client, message: Message):
                     output_path
                 ]
 
+                job.temp_files.add(output_path)
                 proc = await asyncio.create_subprocess_exec(*cmd)
-                await proc.wait()
+                await wait_or_kill(proc, proc.wait())
                 split_files.append(output_path)
 
             return split_files
@@ -677,10 +1189,15 @@ async def handle_message(client: Client, message: Message):
             logger.error(f"Split error: {e}")
             raise
 
-    async def send_media(uploader_client: Client, chat_id: int, path: str, cap: str):
+    async def send_media(uploader_client: Client, chat_id: int, path, cap: str):
         """Send media with correct method based on extension."""
-        e = get_extension(path)
-        if is_video_ext(e):
+        if isinstance(path, io.BytesIO):
+            # In-memory file: may be sent more than once (fallbacks)
+            path.seek(0)
+            e = get_extension(path.name)
+        else:
+            e = get_extension(path)
+        if is_video_ext(e) and not upload_as_document:
             return await uploader_client.send_video(
                 chat_id,
                 path,
@@ -703,7 +1220,7 @@ async def handle_message(client: Client, message: Message):
                 progress=upload_progress
             )
 
-    async def send_file_to_dump_and_user(path, cap, part_info: str = ""):
+    async def send_file_to_dump_and_user(path, cap, part_info: str = "", part: int = 1):
         full_caption = cap + (f"\n\n{part_info}" if part_info else "")
 
         # Always prefer user client if running, else bot
@@ -711,28 +1228,33 @@ async def handle_message(client: Client, message: Message):
 
         # 1) send to dump
         try:
-            sent = await send_media(uploader, DUMP_CHAT_ID, path, full_caption)
+            with trace.span("upload", part=part, target="dump"):
+                sent = await send_media(uploader, DUMP_CHAT_ID, path, full_caption)
         except RPCError as e:
             logger.error(f"BadRequest while sending to dump chat {DUMP_CHAT_ID}: {e}")
             # fallback: send directly to user
             try:
-                await send_media(app, message.chat.id, path, full_caption)
+                with trace.span("upload", part=part, target="user"):
+                    await send_media(app, message.chat.id, path, full_caption)
             except Exception as e2:
                 logger.error(f"Fallback direct send failed: {e2}")
                 raise
         else:
+            dump_index.add_message(sent, bot_view=uploader is app)
             # 2) forward/copy to user
             try:
-                await app.copy_message(
-                    chat_id=message.chat.id,
-                    from_chat_id=DUMP_CHAT_ID,
-                    message_id=sent.id,
-                    caption=full_caption
-                )
+                with trace.span("copy_message", part=part):
+                    await app.copy_message(
+                        chat_id=message.chat.id,
+                        from_chat_id=DUMP_CHAT_ID,
+                        message_id=sent.id,
+                        caption=full_caption
+                    )
             except Exception as e:
                 logger.warning(f"Could not forward from dump to user: {e}")
                 try:
-                    await send_media(app, message.chat.id, path, full_caption)
+                    with trace.span("upload", part=part, target="user"):
+                        await send_media(app, message.chat.id, path, full_caption)
                 except Exception as e2:
                     logger.error(f"Final send to user failed: {e2}")
                     raise
@@ -743,11 +1265,13 @@ async def handle_message(client: Client, message: Message):
             await upload_status(
                 f"✂️ Splitting {display_name} ({format_size(file_size)})"
             )
-            split_files = await split_video_with_ffmpeg(
-                file_path,
-                os.path.splitext(file_path)[0],
-                SPLIT_SIZE
-            )
+            with trace.span("split", size=file_size) as span:
+                split_files = await split_video_with_ffmpeg(
+                    file_path,
+                    os.path.splitext(file_path)[0],
+                    SPLIT_SIZE
+                )
+                span["parts"] = len(split_files)
             try:
                 for idx, part in enumerate(split_files, start=1):
                     await upload_status(
@@ -755,7 +1279,7 @@ async def handle_message(client: Client, message: Message):
                         f"{os.path.basename(part)}"
                     )
                     part_info = f"Part {idx}/{len(split_files)}"
-                    await send_file_to_dump_and_user(part, caption, part_info)
+                    await send_file_to_dump_and_user(part, caption, part_info, part=idx)
             finally:
                 for part in split_files:
                     try:
@@ -770,38 +1294,77 @@ async def handle_message(client: Client, message: Message):
             await send_file_to_dump_and_user(file_path, caption)
     except Exception as e:
         logger.error(f"Upload failed: {e}")
+        job.outcome["result"] = "upload_failed"
         await safe_edit(status_message, f"❌ Upload failed:\n`{e}`")
     finally:
-        if os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-            except Exception:
-                pass
+        if not in_memory and os.path.exists(file_path):
+            with trace.span("cleanup", what="download"):
+                try:
+                    os.remove(file_path)
+                except Exception:
+                    pass
 
-    try:
-        await status_message.delete()
-        await message.delete()
-    except Exception as e:
-        logger.error(f"Cleanup error: {e}")
+    with trace.span("cleanup", what="messages") as span:
+        try:
+            await status_message.delete()
+            await message.delete()
+        except Exception as e:
+            logger.error(f"Cleanup error: {e}")
+            span["status"] = "error"
 
 
 # -------------------------------------------------
-# Flask keep-alive
+# Flask keep-alive + probes
 # -------------------------------------------------
-flask_app = Flask(__name__)
-
+def create_flask_app():
+    # Flask is only imported when the web server is on, and off the main thread
+    from flask import Flask, jsonify, render_template, request
+
+    flask_app = Flask(__name__)
+
+    @flask_app.route("/")
+    def home():
+        return render_template("index.html")
+
+    @flask_app.route("/health")
+    def health():
+        # Liveness: the process is up and serving HTTP
+        return jsonify({"ok": True, "bot_ready": BOT_READY, "aria2": aria2_pool.status()})
+
+    @flask_app.route("/ready")
+    def ready():
+        # Readiness: Telegram is connected and at least one aria2 answers
+        is_ready = BOT_READY and aria2_pool.ready.is_set()
+        return jsonify({"ready": is_ready}), 200 if is_ready else 503
+
+    def _perf_authorized() -> bool:
+        return bool(PERF_TOKEN) and request.args.get("token") == PERF_TOKEN
+
+    @flask_app.route("/perf")
+    def perf_status():
+        if not _perf_authorized():
+            return "Not found", 404
+        return jsonify(perf.monitor.snapshot())
+
+    @flask_app.route("/perf/profile")
+    def perf_profile():
+        if not _perf_authorized():
+            return "Not found", 404
+        try:
+            seconds = min(60.0, max(1.0, float(request.args.get("seconds", 10))))
+        except ValueError:
+            seconds = 10.0
+        return jsonify(perf.monitor.sample(seconds))
 
-@flask_app.route("/")
-def home():
-    return render_template("index.html")
+    return flask_app
 
 
 def run_flask():
-    flask_app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
+    create_flask_app().run(host=settings.web_host, port=settings.port)
 
 
 def keep_alive():
-    Thread(target=run_flask).start()
+    Thread(target=run_flask, name="flask", daemon=True).start()
 
 
 async def start_user_client():
@@ -822,21 +1385,39 @@ async def start_user_client():
         SPLIT_SIZE = 2 * 1024 * 1024 * 1024
 
 
-def run_user():
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(start_user_client())
+async def main():
+    global BOT_READY
+
+    # aria2 comes up in the background while we connect to Telegram
+    aria2_pool.start()
+    stats.start()
+    dump_index.start()
+    tracing.start()
+
+    # Bot and user sessions connect concurrently, on the same loop
+    await asyncio.gather(app.start(), start_user_client())
+    perf.monitor.start()
+    BOT_READY = True
+    if user:
+        # Only a user session can read chat history
+        asyncio.create_task(dump_index.backfill(user, DUMP_CHAT_ID, settings.dump_index_backfill))
+    logger.info(f"Bot ready in {time.perf_counter() - PROCESS_START:.2f}s since process start.")
+
+    await idle()
+    if user:
+        await user.stop()
+    await app.stop()
+    stats.flush()
+    dump_index.save()
+    tracing.stop()
 
 
 # -------------------------------------------------
 # Main
 # -------------------------------------------------
 if __name__ == "__main__":
-    keep_alive()
-
-    if user:
-        logger.info("Starting user client...")
-        Thread(target=run_user).start()
+    if settings.web_server:
+        keep_alive()
 
     logger.info("Starting bot client...")
-    app.run()
+    app.run(main())
@@ -0,0 +1,122 @@
+# trace_report.py
+"""
+Offline report over the span files written by tracing.py.
+
+    python trace_report.py                     # TRACE_FILE (+ rotated .1, .2, ...)
+    python trace_report.py traces.jsonl.3 --since 24 --slowest 20
+
+Prints, per stage, how many jobs hit it and the p50 / p90 / p99 / max time a
+job spent there (spans of the same stage in one job, e.g. every part upload,
+are summed), plus each stage's share of total job time and the slowest jobs
+with the stage that dominated them.
+"""
+import argparse
+import collections
+import glob
+import json
+import os
+import sys
+import time
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    idx = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[idx]
+
+
+def _default_files() -> list[str]:
+    base = os.environ.get("TRACE_FILE", "traces.jsonl")
+    return [base] + sorted(glob.glob(base + ".[0-9]*"))
+
+
+def load_spans(paths: list[str], since: float | None = None):
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    span = json.loads(line)
+                except ValueError:
+                    continue  # a line cut short by rotation or a crash
+                if since is not None and span.get("start", 0) < since:
+                    continue
+                yield span
+
+
+def build_report(spans, slowest: int = 10) -> str:
+    # trace -> stage -> summed ms
+    per_job: dict[str, collections.Counter] = collections.defaultdict(collections.Counter)
+    roots: dict[str, dict] = {}
+    failures = collections.Counter()
+    for span in spans:
+        if span["span"] == "job":
+            roots[span["trace"]] = span
+            continue
+        per_job[span["trace"]][span["span"]] += span["dur_ms"]
+        if span.get("status", "ok") != "ok":
+            failures[span["span"]] += 1
+
+    by_stage: dict[str, list[float]] = collections.defaultdict(list)
+    for stages in per_job.values():
+        for stage, ms in stages.items():
+            by_stage[stage].append(ms)
+    total_ms = sum(sum(v) for v in by_stage.values()) or 1.0
+
+    lines = [
+        f"{len(roots)} jobs, {sum(len(v) for v in by_stage.values())} stage timings",
+        "",
+        f"{'stage':<14}{'jobs':>6}{'p50 s':>9}{'p90 s':>9}{'p99 s':>9}{'max s':>9}{'share':>8}{'!ok':>6}",
+    ]
+    order = sorted(by_stage, key=lambda st: _percentile(by_stage[st], 90), reverse=True)
+    for stage in order:
+        values = by_stage[stage]
+        lines.append(
+            f"{stage:<14}{len(values):>6}"
+            f"{_percentile(values, 50) / 1000:>9.2f}"
+            f"{_percentile(values, 90) / 1000:>9.2f}"
+            f"{_percentile(values, 99) / 1000:>9.2f}"
+            f"{max(values) / 1000:>9.2f}"
+            f"{sum(values) * 100 / total_ms:>7.1f}%"
+            f"{failures[stage]:>6}"
+        )
+
+    statuses = collections.Counter(r.get("status", "ok") for r in roots.values())
+    if statuses:
+        lines += ["", "job status: " + ", ".join(f"{s}={n}" for s, n in statuses.most_common())]
+
+    worst = sorted(roots.values(), key=lambda r: r["dur_ms"], reverse=True)[:slowest]
+    if worst:
+        lines += ["", f"slowest {len(worst)} jobs:"]
+        for root in worst:
+            stages = per_job.get(root["trace"])
+            top = stages.most_common(1)[0] if stages else ("-", 0)
+            lines.append(
+                f"  {root['trace']}  {root['dur_ms'] / 1000:>8.2f}s  {root.get('status', 'ok'):<12}"
+                f"mostly {top[0]} ({top[1] / 1000:.2f}s)"
+                + (f"  size={root['size']}" if "size" in root else "")
+            )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-stage latency percentiles from job trace files.")
+    parser.add_argument("files", nargs="*", help="span files (default: TRACE_FILE and its rotations)")
+    parser.add_argument("--since", type=float, help="only spans from the last N hours")
+    parser.add_argument("--slowest", type=int, default=10, help="how many slowest jobs to list")
+    args = parser.parse_args(argv)
+
+    since = time.time() - args.since * 3600 if args.since else None
+    spans = list(load_spans(args.files or _default_files(), since))
+    if not spans:
+        print("No spans found.", file=sys.stderr)
+        return 1
+    print(build_report(spans, args.slowest))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
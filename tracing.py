@@ -0,0 +1,121 @@
+# tracing.py
+"""
+Per-job span timelines, exported as JSON lines.
+
+Every job gets a Trace whose id is the job id. Stages are timed with
+`trace.span("resolve")` (a context manager) or recorded after the fact with
+`trace.add(...)`; each finished span becomes one JSON line:
+
+    {"trace": "1a2b3c4d", "span": "download", "start": 1718000000.12,
+     "dur_ms": 5321.4, "status": "ok", "engine": "aria2", ...}
+
+Lines go through a logging QueueHandler, so emitting a span is only a
+queue put on the event loop. A QueueListener thread writes them to a
+rotating TRACE_FILE. Run trace_report.py on the file(s) for per-stage
+percentiles.
+"""
+import asyncio
+import contextlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import time
+
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Spans only, never mixed with the normal log output
+span_logger = logging.getLogger("terabox.spans")
+span_logger.propagate = False
+span_logger.setLevel(logging.INFO)
+
+_listener: logging.handlers.QueueListener | None = None
+
+
+class JsonLineFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps(record.span, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def start():
+    """Start the background writer. Without TRACE_FILE spans are dropped."""
+    global _listener
+    settings = get_settings()
+    if _listener is not None or not settings.trace_file:
+        return
+    directory = os.path.dirname(settings.trace_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    file_handler = logging.handlers.RotatingFileHandler(
+        settings.trace_file,
+        maxBytes=settings.trace_max_bytes,
+        backupCount=settings.trace_backups,
+        encoding="utf-8",
+    )
+    file_handler.setFormatter(JsonLineFormatter())
+    q = queue.SimpleQueue()
+    span_logger.addHandler(logging.handlers.QueueHandler(q))
+    _listener = logging.handlers.QueueListener(q, file_handler)
+    _listener.start()
+    logger.info(f"[TRACE] Writing spans to {settings.trace_file}")
+
+
+def stop():
+    """Flush queued spans and stop the writer."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _status_of(exc: BaseException) -> str:
+    return "cancelled" if isinstance(exc, asyncio.CancelledError) else "error"
+
+
+class Trace:
+    def __init__(self, **attrs):
+        self.id = os.urandom(4).hex()
+        self.attrs = attrs
+        self.started = time.time()
+        self.finished = False
+
+    def add(self, name: str, start: float, end: float, status: str = "ok", **attrs):
+        """Record a span that has already happened (start/end are time.time() values)."""
+        if not span_logger.handlers:
+            return
+        span = {
+            "trace": self.id,
+            "span": name,
+            "start": round(start, 3),
+            "dur_ms": round((end - start) * 1000, 1),
+            "status": status,
+            **attrs,
+        }
+        span_logger.info(name, extra={"span": span})
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attrs):
+        """
+        Time the block as one span. The yielded dict can be filled with extra
+        attributes; setting "status" marks a failure that didn't raise.
+        """
+        start = time.time()
+        info = dict(attrs)
+        try:
+            yield info
+        except BaseException as e:
+            info["status"] = _status_of(e)
+            info.setdefault("error", repr(e)[:200])
+            raise
+        finally:
+            self.add(name, start, time.time(), **{"status": "ok", **info})
+
+    def finish(self, status: str = "ok", **attrs):
+        """Emit the root "job" span covering the whole trace (once)."""
+        if self.finished:
+            return
+        self.finished = True
+        self.add("job", self.started, time.time(), status=status, **self.attrs, **attrs)
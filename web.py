@@ -1,27 +1,44 @@
 # web.py
 import os
 import subprocess
-from flask import Flask, jsonify
+import sys
+import urllib.error
+import urllib.request
+from flask import Flask, Response, jsonify, request
 
 app = Flask(__name__)
 
-# Default command to run bot — same as repo's start.sh
-BOT_CMD = os.environ.get("BOT_CMD", "bash start.sh")
+# Run the bot directly: aria2 is supervised by the bot itself now, so going
+# through bash start.sh only adds a process hop (and its fixed sleep).
+BOT_CMD = os.environ.get("BOT_CMD", f"{sys.executable} terabox.py")
+
+# The bot serves /ready and /perf itself on this loopback-only port; the
+# public PORT belongs to this process, which proxies those routes through
+BOT_WEB_PORT = int(os.environ.get("BOT_WEB_PORT", 8081))
 
 bot_proc = None
 
-@app.before_first_request
 def start_bot_process():
     global bot_proc
     if bot_proc is None:
         try:
             parts = BOT_CMD.strip().split()
+            # This process already serves PORT, so the bot's own server
+            # listens on an internal port instead
+            env = dict(os.environ)
+            env["WEB_SERVER"] = "true"
+            env["WEB_HOST"] = "127.0.0.1"
+            env["PORT"] = str(BOT_WEB_PORT)
             # Don't pipe output — let Render show bot logs
-            bot_proc = subprocess.Popen(parts)
+            bot_proc = subprocess.Popen(parts, env=env)
             app.logger.info(f"✅ Started bot subprocess (pid={bot_proc.pid}) using: {BOT_CMD}")
         except Exception as e:
             app.logger.error(f"❌ Failed to start bot subprocess: {e}")
 
+# Start at import instead of on the first HTTP request, so the bot doesn't
+# wait for the platform's first health check to begin connecting
+start_bot_process()
+
 @app.route("/")
 def index():
     return "✅ Bot is running on Render", 200
@@ -34,6 +51,32 @@ def health():
         "bot_pid": bot_proc.pid if bot_proc else None
     })
 
+def proxy_to_bot(path: str, timeout: float):
+    url = f"http://127.0.0.1:{BOT_WEB_PORT}{path}"
+    if request.query_string:
+        url += "?" + request.query_string.decode()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as resp:
+            return Response(resp.read(), status=resp.status, content_type=resp.headers.get("Content-Type"))
+    except urllib.error.HTTPError as e:
+        return Response(e.read(), status=e.code, content_type=e.headers.get("Content-Type"))
+    except Exception as e:
+        # Bot still starting (or gone): not ready
+        return jsonify({"ready": False, "error": str(e)}), 503
+
+@app.route("/ready")
+def ready():
+    return proxy_to_bot("/ready", timeout=5)
+
+@app.route("/perf")
+def perf_status():
+    return proxy_to_bot("/perf", timeout=10)
+
+@app.route("/perf/profile")
+def perf_profile():
+    # Sampling takes up to 60 s on the bot side
+    return proxy_to_bot("/perf/profile", timeout=75)
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8000))
     app.run(host="0.0.0.0", port=port)